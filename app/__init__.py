@@ -5,8 +5,11 @@
 This is a web service to print labels on Brother QL label printers.
 """
 
+import os
 import sys
+import time
 import random
+import threading
 
 from flask import Flask
 from flask_bootstrap import Bootstrap
@@ -18,13 +21,30 @@ bootstrap = Bootstrap()
 
 
 def create_app(config_class=Config):
+    started = time.perf_counter()
+    timings = []
+
+    def phase(name):
+        nonlocal started
+        now = time.perf_counter()
+        timings.append((name, now - started))
+        started = now
+
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config_class)
     app.config.from_pyfile('application.py', silent=True)
 
     app.logger.setLevel(app.config['LOG_LEVEL'])
+    phase('config')
 
-    main(app)
+    rescan = main(app)
+    phase('font scan')
+
+    # the render workers are forked before the server starts any thread
+    start_render_pool(app)
+    if rescan is not None:
+        rescan.start()
+    phase('render pool')
 
     app.config['BOOTSTRAP_SERVE_LOCAL'] = True
     bootstrap.init_app(app)
@@ -37,6 +57,18 @@ def create_app(config_class=Config):
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
+    phase('blueprint registration')
+
+    if app.config['WARM_UP']:
+        from app.labeldesigner.routes import warm_up
+        with app.app_context():
+            warm_up()
+        phase('warm-up')
+
+    app.logger.info('Started in %.3fs (%s)',
+                    sum(seconds for name, seconds in timings),
+                    ', '.join('{} {:.3f}s'.format(name, seconds)
+                              for name, seconds in timings))
 
     return app
 
@@ -44,10 +76,10 @@ def create_app(config_class=Config):
 def main(app):
     global FONTS
 
+    fonts.font_cache.maxsize = app.config['FONT_CACHE_SIZE']
+
     FONTS = fonts.Fonts()
-    FONTS.scan_global_fonts()
-    if app.config['FONT_FOLDER']:
-        FONTS.scan_fonts_folder(app.config['FONT_FOLDER'])
+    rescan = load_fonts(app, FONTS)
 
     if not FONTS.fonts_available():
         app.logger.error(
@@ -67,3 +99,45 @@ def main(app):
         app.config['LABEL_DEFAULT_FONT_STYLE'] = style
         app.logger.warn(
             'The default font is now set to: {} ({})\n'.format(family, style))
+
+    return rescan
+
+
+def start_render_pool(app):
+    from app.labeldesigner.render import render_pool
+
+    render_pool.workers = app.config['RENDER_POOL_WORKERS']
+    render_pool.threshold = app.config['RENDER_POOL_THRESHOLD']
+    render_pool.start(
+        font_paths=FONTS.fonts[app.config['LABEL_DEFAULT_FONT_FAMILY']].values(),
+        font_size=app.config['LABEL_DEFAULT_FONT_SIZE'])
+
+
+def load_fonts(app, fonts_index):
+    """ Loads the fonts from the saved index if the font directories didn't
+    change, otherwise scans them (in the background if there is an older
+    index to start with) and saves the index for the next start.
+    :return: the thread of the background scan, not started yet, or None
+    """
+    folder = app.config['FONT_FOLDER']
+    if not app.config['FONT_INDEX_FILE']:
+        fonts_index.scan(folder)
+        return None
+
+    index_path = os.path.join(app.instance_path, app.config['FONT_INDEX_FILE'])
+    signature = fonts.font_dirs_signature(
+        fonts.SYSTEM_FONT_DIRS + ([folder] if folder else []))
+
+    up_to_date = fonts_index.load_index(index_path, signature)
+    if up_to_date:
+        app.logger.debug('Loaded the fonts from %s', index_path)
+    elif up_to_date is None or not fonts_index.fonts_available():
+        fonts_index.scan(folder)
+        if fonts_index.fonts_available():
+            fonts_index.save_index(index_path, signature)
+    else:
+        app.logger.info('Font directories changed, scanning the fonts in the background')
+        return threading.Thread(target=fonts_index.rescan,
+                                args=(folder, index_path, signature),
+                                daemon=True)
+    return None
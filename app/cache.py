@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Thread-safe least recently used cache with hit/miss counters
+
+    Entries are evicted once there are more than maxsize of them or, if
+    maxbytes is set, once the sizes reported by sizeof add up to more than
+    maxbytes. With a ttl (seconds) entries also expire after that time.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=len, ttl=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, nbytes, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        nbytes = self._sizeof(value) if self.maxbytes is not None else 0
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, nbytes, expires)
+            self.nbytes += nbytes
+            while len(self._data) > self.maxsize or \
+                    (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+
+    def get_or_create(self, key, factory):
+        """ returns the cached value for key, calls factory() on a miss
+        :param key: hashable cache key
+        :param factory: callable creating the value, called without holding the lock
+        :return: the cached or newly created value
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            info = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+            if self.maxbytes is not None:
+                info['bytes'] = self.nbytes
+                info['maxbytes'] = self.maxbytes
+            return info
+
+    def _remove(self, key):
+        value, nbytes, expires = self._data.pop(key)
+        self.nbytes -= nbytes
+
+    def __len__(self):
+        return len(self._data)
@@ -1,11 +1,62 @@
-import subprocess
+import os
 import sys
+import json
+import hashlib
+import tempfile
+import subprocess
 from collections import defaultdict
 
+from PIL import ImageFont
+
+from .cache import LRUCache
+
+# Loaded FreeTypeFont objects shared by all label rendering
+font_cache = LRUCache(maxsize=256)
+
+# Directories fc-list finds fonts in on common systems
+SYSTEM_FONT_DIRS = [
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    '~/.fonts',
+    '~/.local/share/fonts',
+]
+
+
+def get_font(path, size, layout_engine=None):
+    """ Returns a loaded font, parsing the font file only on the first use
+    :param path: path of the TrueType/OpenType font file
+    :param size: font size in pixels
+    :param layout_engine: optional PIL layout engine (ImageFont.Layout)
+    :return: ImageFont.FreeTypeFont
+    """
+    return font_cache.get_or_create(
+        (path, size, layout_engine),
+        lambda: ImageFont.truetype(path, size, layout_engine=layout_engine))
+
+
+def font_dirs_signature(dirs):
+    """ Modification times of the font directories and all directories below
+    them, which change when fonts are added or removed (like fontconfig's
+    own cache, fonts replaced in place are not noticed)
+    :param dirs: list of directories, missing ones are skipped
+    :return: list of [directory, mtime] pairs
+    """
+    signature = []
+    for top in dirs:
+        top = os.path.expanduser(top)
+        for path, subdirs, files in os.walk(top):
+            try:
+                signature.append([path, os.stat(path).st_mtime_ns])
+            except OSError:
+                continue
+            subdirs.sort()
+    return signature
+
 
 class Fonts:
     def __init__(self):
         self.fonts = defaultdict(dict)
+        self.version = None
 
     def parse_fonts(self, raw):
         """ adds the found fonts the the fonts list
@@ -61,6 +112,56 @@ class Fonts:
 
         self.parse_fonts(raw)
 
+    def scan(self, folder=''):
+        """ finds all fonts of the system and of folder (if given) """
+        self.scan_global_fonts()
+        if folder:
+            self.scan_fonts_folder(folder)
+        self.update_version()
+
+    def rescan(self, folder, index_path, signature):
+        """ scans the fonts again, replaces the index once done and saves it """
+        scanned = Fonts()
+        scanned.scan(folder)
+        if scanned.fonts_available():
+            self.fonts, self.version = scanned.fonts, scanned.version
+            self.save_index(index_path, signature)
+
+    def update_version(self):
+        """ digest of the index, changes whenever the fonts found change """
+        self.version = hashlib.sha1(
+            json.dumps(self.fonts, sort_keys=True).encode()).hexdigest()
+
+    def load_index(self, path, signature):
+        """ loads the fonts from an index written by save_index()
+        :param signature: font_dirs_signature() of the font directories
+        :return: None if there is no readable index, otherwise whether it
+                 was saved for the same signature (the fonts are loaded
+                 even if it wasn't)
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                index = json.load(f)
+            fonts = index['fonts']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        self.fonts = defaultdict(dict, fonts)
+        self.update_version()
+        return index.get('signature') == signature
+
+    def save_index(self, path, signature):
+        """ writes the fonts to path, replacing it at once as other server
+        processes may be reading it """
+        folder = os.path.dirname(path)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'signature': signature, 'fonts': self.fonts}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print('Could not save the font index: {}'.format(e), file=sys.stderr)
+
     def fontlist(self):
         return sorted(self.fonts, key=str.lower)
 
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+from PIL import Image
+
+from app.cache import LRUCache
+from app.utils import convert_image_to_bw, imgbytes_to_image, \
+    pdfbytes_to_images, pdfbytes_page_count
+
+# Threshold used to turn uploaded images into black & white
+BW_THRESHOLD = 200
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+PDF_EXTENSIONS = ('.pdf',)
+
+_asset_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UnknownAssetError(LookupError):
+    """ The asset was never uploaded or was dropped from the store """
+
+
+def image_nbytes(im):
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+
+class AssetStore:
+    """
+    Uploaded images and PDFs, decoded, rasterized and thresholded once.
+
+    The black & white results are kept in memory and as PNG files in folder.
+    Both are bounded in size, the least recently used assets are dropped.
+    Assets are identified by a digest of the uploaded file. PDFs are kept as
+    uploaded and only the requested pages are rasterized, straight to the
+    size they are printed at.
+    """
+
+    def __init__(self, folder=None, maxbytes=64*1024*1024,
+                 memory_maxbytes=32*1024*1024, dpi=300, processes=None):
+        self.folder = folder
+        self.maxbytes = maxbytes
+        self.dpi = dpi
+        self.processes = processes or os.cpu_count() or 1
+        self._memory = LRUCache(maxsize=256, maxbytes=memory_maxbytes,
+                                sizeof=image_nbytes)
+        self._pdfs = LRUCache(maxsize=16, maxbytes=memory_maxbytes)
+        self._page_counts = LRUCache(maxsize=256)
+        self._lock = threading.Lock()
+
+    @property
+    def memory_maxbytes(self):
+        return self._memory.maxbytes
+
+    @memory_maxbytes.setter
+    def memory_maxbytes(self, value):
+        self._memory.maxbytes = value
+        self._pdfs.maxbytes = value
+
+    def add(self, file):
+        """ stores an uploaded file
+        :param file: uploaded werkzeug FileStorage (.png, .jpg, .jpeg or .pdf)
+        :return: the asset id
+        """
+        data = file.read()
+        asset_id = hashlib.sha256(data).hexdigest()[:32]
+
+        name, ext = os.path.splitext(file.filename or '')
+        if ext.lower() in IMAGE_EXTENSIONS:
+            if self._load(asset_id) is None:
+                image = convert_image_to_bw(imgbytes_to_image(data), BW_THRESHOLD)
+                self._store(asset_id, image)
+        elif ext.lower() in PDF_EXTENSIONS:
+            if self._get_pdf(asset_id) is None:
+                self._page_counts.put(asset_id, pdfbytes_page_count(data))
+                self._pdfs.put(asset_id, data)
+                self._write(asset_id + '.pdf', data)
+        else:
+            raise ValueError('Unsupported file type, use PNG, JPEG or PDF')
+        return asset_id
+
+    def get(self, asset_id, page=1, size=None):
+        """ returns the black & white image of an asset, None if unknown
+        :param page: page of a PDF, starting at 1
+        :param size: (width, height) to scale PDF pages to, see pdfbytes_to_images()
+        """
+        if not _asset_id_re.match(asset_id or ''):
+            return None
+        image = self._load(asset_id)
+        if image is None:
+            image = self._load(self._page_key(asset_id, page, size))
+        if image is None:
+            images = self._rasterize(asset_id, page, page, size)
+            image = images[0] if images else None
+        return image
+
+    def get_pages(self, asset_id, size=None):
+        """ returns the black & white images of all pages of an asset, None if unknown """
+        if not _asset_id_re.match(asset_id or ''):
+            return None
+        image = self._load(asset_id)
+        if image is not None:
+            return [image]
+        page_count = self.page_count(asset_id)
+        if page_count is None:
+            return None
+
+        images = [self._load(self._page_key(asset_id, page, size))
+                  for page in range(1, page_count + 1)]
+        missing = [page for page, image in enumerate(images, 1) if image is None]
+        if missing:
+            rasterized = self._rasterize(asset_id, missing[0], missing[-1], size)
+            for page, image in enumerate(rasterized, missing[0]):
+                images[page - 1] = image
+        return images
+
+    def page_count(self, asset_id):
+        """ number of pages of an asset, None if unknown """
+        if self._load(asset_id) is not None:
+            return 1
+        page_count = self._page_counts.get(asset_id)
+        if page_count is None:
+            data = self._get_pdf(asset_id)
+            if data is None:
+                return None
+            page_count = pdfbytes_page_count(data)
+            self._page_counts.put(asset_id, page_count)
+        return page_count
+
+    def info(self):
+        info = self._memory.info()
+        info['folder'] = self.folder
+        return info
+
+    def _rasterize(self, asset_id, first_page, last_page, size):
+        data = self._get_pdf(asset_id)
+        if data is None:
+            return []
+        processes = min(self.processes, last_page - first_page + 1)
+        images = pdfbytes_to_images(data, self.dpi, first_page, last_page,
+                                    size, processes)
+        result = []
+        for page, image in enumerate(images, first_page):
+            image = convert_image_to_bw(image, BW_THRESHOLD)
+            self._store(self._page_key(asset_id, page, size), image)
+            result.append(image)
+        return result
+
+    def _page_key(self, asset_id, page, size):
+        width, height = size or (None, None)
+        return '{}-{}-{}x{}'.format(asset_id, page, width or '', height or '')
+
+    def _get_pdf(self, asset_id):
+        data = self._pdfs.get(asset_id)
+        if data is None and self.folder:
+            path = self._path(asset_id + '.pdf')
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                return None
+            self._pdfs.put(asset_id, data)
+        return data
+
+    def _load(self, key):
+        image = self._memory.get(key)
+        if image is not None or not self.folder:
+            return image
+
+        path = self._path(key + '.png')
+        try:
+            with Image.open(path) as im:
+                image = im.convert('1')
+            os.utime(path)
+        except OSError:
+            return None
+        self._memory.put(key, image)
+        return image
+
+    def _store(self, key, image):
+        self._memory.put(key, image)
+        if self.folder:
+            with self._lock:
+                self._replace(key + '.png',
+                              lambda f: image.save(f, format='PNG'))
+                self._prune()
+
+    def _write(self, name, data):
+        if self.folder:
+            with self._lock:
+                self._replace(name, lambda f: f.write(data))
+                self._prune()
+
+    def _replace(self, name, write):
+        # written next to the file and renamed, _load() and _get_pdf() read
+        # without the lock and must not see half-written files
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _prune(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(('.png', '.pdf')):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxbytes:
+                break
+            os.remove(path)
+            total -= size
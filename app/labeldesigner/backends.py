@@ -0,0 +1,155 @@
+import logging
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from brother_ql.backends import backend_factory, guess_backend
+
+logger = logging.getLogger(__name__)
+
+
+class ManagedBackend:
+    """
+    Long-lived connection to one printer device
+
+    The connection is opened on the first write and kept open for the next
+    ones. Writes are serialized by a lock. Opening the connection is retried
+    with exponential backoff, a write that failed may have printed part of
+    the data already and closes the connection without trying again.
+    """
+
+    def __init__(self, device_specifier, retries=3, backoff=0.5):
+        self.device_specifier = device_specifier
+        self.retries = retries
+        self.backoff = backoff
+        self.last_used = 0
+        self._backend_class = backend_factory(
+            guess_backend(device_specifier))['backend_class']
+        self._backend = None
+        self._lock = threading.RLock()
+
+    @property
+    def connected(self):
+        return self._backend is not None
+
+    def write(self, data):
+        with self._lock:
+            self._connect()
+            try:
+                self._backend.write(data)
+            except Exception:
+                self._close()
+                raise
+            self.last_used = time.monotonic()
+
+    @contextmanager
+    def session(self):
+        """ keeps other writers out while doing several writes """
+        with self._lock:
+            yield self
+
+    def close_if_idle(self, idle_timeout):
+        # a busy connection is not idle, don't wait for it
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._backend is not None and \
+                    time.monotonic() - self.last_used > idle_timeout:
+                logger.debug('Closing idle connection to %s', self.device_specifier)
+                self._close()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _connect(self):
+        # nothing is written yet, connecting again can't print twice
+        for attempt in range(self.retries + 1):
+            try:
+                if self._backend is None or self._is_stale():
+                    self._close()
+                    self._backend = self._backend_class(self.device_specifier)
+                return
+            except Exception as e:
+                self._close()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning('Connecting to %s failed (%s), retrying in %.1fs',
+                               self.device_specifier, e, delay)
+                time.sleep(delay)
+
+    def _is_stale(self):
+        # A TCP connection closed by the printer only fails on a later write,
+        # after the data of this one is lost. Check for the close beforehand.
+        sock = getattr(self._backend, 's', None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _close(self):
+        if self._backend is None:
+            return
+        try:
+            self._backend.dispose()
+        except Exception as e:
+            logger.debug('Closing %s failed: %s', self.device_specifier, e)
+        self._backend = None
+
+
+class BackendManager:
+    """ Keeps one ManagedBackend per device and closes idle connections """
+
+    def __init__(self, idle_timeout=30, retries=3, backoff=0.5):
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._backends = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def get(self, device_specifier):
+        with self._lock:
+            backend = self._backends.get(device_specifier)
+            if backend is None:
+                backend = ManagedBackend(device_specifier, self.retries, self.backoff)
+                self._backends[device_specifier] = backend
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._close_idle, name='backend reaper', daemon=True)
+                self._reaper.start()
+            return backend
+
+    def write(self, device_specifier, data):
+        self.get(device_specifier).write(data)
+
+    def close_all(self):
+        with self._lock:
+            backends = list(self._backends.values())
+        for backend in backends:
+            backend.close()
+
+    def info(self):
+        with self._lock:
+            return {device_specifier: {'connected': backend.connected,
+                                       'last_used': backend.last_used}
+                    for device_specifier, backend in self._backends.items()}
+
+    def _close_idle(self):
+        while True:
+            time.sleep(max(1, self.idle_timeout / 4))
+            with self._lock:
+                backends = list(self._backends.values())
+            for backend in backends:
+                backend.close_if_idle(self.idle_timeout)
+
+
+backend_manager = BackendManager()
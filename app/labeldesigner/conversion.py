@@ -0,0 +1,132 @@
+from PIL import Image, ImageChops
+
+from brother_ql import BrotherQLUnsupportedCmd
+from brother_ql.devicedependent import label_type_specs, ENDLESS_LABEL, \
+    DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL, right_margin_addition
+
+from app.utils import PRINT_THRESHOLD
+
+# The colors brother_ql prints red (hue, saturation, value) and black (value)
+_red_hue = [255 if (h < 40 or h > 210) else 0 for h in range(256)]
+_red_saturation = [255 if s > 100 else 0 for s in range(256)]
+_red_value = [255 if v > 80 else 0 for v in range(256)]
+_black_value = [255 if v < 80 else 0 for v in range(256)]
+_ink = [255 if x <= PRINT_THRESHOLD else 0 for x in range(256)]
+
+
+def separate_colors(im):
+    """ splits a label into the planes printed in black and in red
+
+    Gives the same result as brother_ql's conversion for two-color labels,
+    but with whole-image operations instead of a Python loop over pixels.
+    :param im: 'L' or 'RGB' image
+    :return: (black, red) 1-bit images, set pixels are printed
+    """
+    if im.mode in ('1', 'L'):
+        # grey has no saturation, nothing is red
+        black = im.convert('L').point(_black_value, '1')
+        return black, Image.new('1', im.size, 0)
+
+    im = im.convert('RGB')
+    hue, saturation, value = im.convert('HSV').split()
+    ink = im.convert('L').point(_ink, '1')
+
+    red = ImageChops.logical_and(
+        ImageChops.logical_and(hue.point(_red_hue, '1'),
+                               saturation.point(_red_saturation, '1')),
+        value.point(_red_value, '1'))
+    red = ImageChops.logical_and(red, ink)
+
+    black = ImageChops.logical_and(value.point(_black_value, '1'), ink)
+    black = ImageChops.subtract(black, red)
+    return black, red
+
+
+def create_two_color_label(qlr, im, label_size, cut=True, rotate='auto'):
+    """ adds a label for black and red media to qlr
+
+    Mirrors brother_ql's create_label(red=True) with the default threshold,
+    using separate_colors() to get the planes.
+    """
+    label_specs = label_type_specs[label_size]
+    dots_printable = label_specs['dots_printable']
+    right_margin_dots = label_specs['right_margin_dots']
+    right_margin_dots += right_margin_addition.get(qlr.model, 0)
+    device_pixel_width = qlr.get_pixel_width()
+    if rotate != 'auto':
+        rotate = int(rotate)
+
+    if not qlr.two_color_support:
+        raise BrotherQLUnsupportedCmd('Printing in red is not supported with the selected model.')
+
+    try:
+        qlr.add_switch_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.add_invalidate()
+    qlr.add_initialize()
+    try:
+        qlr.add_switch_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+
+    if im.mode.endswith('A'):
+        bg = Image.new('RGB', im.size, (255, 255, 255))
+        bg.paste(im, im.split()[-1])
+        im = bg
+    elif im.mode not in ('1', 'L', 'RGB'):
+        im = im.convert('RGB')
+    white = 255 if im.mode in ('1', 'L') else (255, 255, 255)
+
+    if label_specs['kind'] == ENDLESS_LABEL:
+        if rotate not in ('auto', 0):
+            im = im.rotate(rotate, expand=True)
+        if im.size[0] != dots_printable[0]:
+            hsize = int((dots_printable[0] / im.size[0]) * im.size[1])
+            im = im.resize((dots_printable[0], hsize), Image.LANCZOS)
+        if im.size[0] < device_pixel_width:
+            new_im = Image.new(im.mode, (device_pixel_width, im.size[1]), white)
+            new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
+            im = new_im
+    elif label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
+        if rotate == 'auto':
+            if im.size[0] == dots_printable[1] and im.size[1] == dots_printable[0]:
+                im = im.rotate(90, expand=True)
+        elif rotate != 0:
+            im = im.rotate(rotate, expand=True)
+        if im.size[0] != dots_printable[0] or im.size[1] != dots_printable[1]:
+            raise ValueError("Bad image dimensions: %s. Expecting: %s." % (im.size, dots_printable))
+        new_im = Image.new(im.mode, (device_pixel_width, dots_printable[1]), white)
+        new_im.paste(im, (device_pixel_width-im.size[0]-right_margin_dots, 0))
+        im = new_im
+
+    black_im, red_im = separate_colors(im)
+
+    qlr.add_status_information()
+    tape_size = label_specs['tape_size']
+    if label_specs['kind'] in (DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL):
+        qlr.mtype = 0x0B
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = tape_size[1]
+    else:
+        qlr.mtype = 0x0A
+        qlr.mwidth = tape_size[0]
+        qlr.mlength = 0
+    qlr.pquality = 1
+    qlr.add_media_and_quality(im.size[1])
+    try:
+        if cut:
+            qlr.add_autocut(True)
+            qlr.add_cut_every(1)
+    except BrotherQLUnsupportedCmd:
+        pass
+    try:
+        qlr.dpi_600 = False
+        qlr.cut_at_end = cut
+        qlr.two_color_printing = True
+        qlr.add_expanded_mode()
+    except BrotherQLUnsupportedCmd:
+        pass
+    qlr.add_margins(label_specs['feed_margin'])
+    qlr.add_raster_data(black_im, red_im)
+    qlr.add_print()
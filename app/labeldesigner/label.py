@@ -1,10 +1,58 @@
+import logging
 from enum import Enum, auto
 from qrcode import QRCode, constants
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
-import requests
-import json
-import yaml
+from PIL import Image, ImageDraw, ImageOps
+from app.cache import LRUCache
+from app.fonts import get_font
+from .partsbox import get_client
+from .layout import wrap_text
+from .label_templates import PARTSBOX_PART, PARTSBOX_STORAGE
+
+logger = logging.getLogger(__name__)
+
+# QR code images by (data, correction, box size, color), see get_qr_image()
+qr_cache = LRUCache(maxsize=256, maxbytes=16*1024*1024,
+                    sizeof=lambda im: im.size[0] * im.size[1] * len(im.getbands()))
+
+
+def get_qr_image(data, error_correction, box_size, color='black'):
+    """ returns the image of a QR code without border, shared by all callers
+    :param error_correction: one of qrcode.constants.ERROR_CORRECT_*
+    :param box_size: pixels per module
+    :param color: color of the dark modules, the background is white
+    :return: a 1-bit image for black, RGB otherwise. Don't modify it.
+    """
+    def make():
+        qr = QRCode(
+            version=1,
+            error_correction=error_correction,
+            box_size=box_size,
+            border=0,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        # One pixel per module, scaled up instead of drawing each module
+        matrix = qr.get_matrix()
+        n = len(matrix)
+        modules = Image.frombytes(
+            'L', (n, n), bytes(0 if dark else 255 for row in matrix for dark in row))
+        img = modules.resize((n*box_size, n*box_size), Image.NEAREST).convert('1')
+        if color != 'black':
+            img = ImageOps.colorize(img.convert('L'), black=color, white='white')
+        return img
+
+    return qr_cache.get_or_create((data, error_correction, box_size, color), make)
+
+
+def get_ink(color, mode):
+    """ returns color as fill for drawing on an image of mode
+    RGB tuples become grey levels on 'L' images, like Image.convert('L') does
+    """
+    if mode == 'L' and isinstance(color, tuple):
+        r, g, b = color[:3]
+        return (r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16
+    return color
 
 class LabelContent(Enum):
     TEXT_ONLY = auto()
@@ -60,7 +108,9 @@ class SimpleLabel:
             line_spacing=100,
             partsbox_user_url='',
             partsbox_api_url='',
-            partsbox_api_key=''):
+            partsbox_api_key='',
+            partsbox_fields=None,
+            partsbox_config=None):
         self._width = width
         self._height = height
         self.label_content = label_content
@@ -80,6 +130,8 @@ class SimpleLabel:
         self.partsbox_user_url = partsbox_user_url
         self.partsbox_api_url = partsbox_api_url
         self.partsbox_api_key = partsbox_api_key
+        self.partsbox_fields = partsbox_fields
+        self._partsbox_config = partsbox_config
 
     @property
     def label_content(self):
@@ -97,6 +149,15 @@ class SimpleLabel:
     def text(self, value):
         self._text = value
 
+    @property
+    def partsbox_fields(self):
+        # prefetched fields of a PartsBox part, a dict or a future of one
+        return self._partsbox_fields
+
+    @partsbox_fields.setter
+    def partsbox_fields(self, value):
+        self._partsbox_fields = value
+
     @property
     def qr_correction(self):
         for key, val in self.qr_correction_mapping:
@@ -124,22 +185,46 @@ class SimpleLabel:
     def label_type(self, value):
         self._label_type = value
 
-    
+
+    # Upper bound for the font size search of 'fill' texts
+    MAX_FONT_SIZE = 1024
+
     def get_font_size(self, text, font, max_width=None, max_height=None):
         if max_width is None and max_height is None:
             raise ValueError('You need to pass max_width or max_height')
-        font_size = 1
-        text_size = self.get_text_size(font, font_size, text)
-        if (max_width is not None and text_size[0] > max_width) or \
-            (max_height is not None and text_size[1] > max_height):
+        text_sizes = {}
+
+        def text_size(font_size):
+            if font_size not in text_sizes:
+                text_sizes[font_size] = self.get_text_size(font, font_size, text)
+            return text_sizes[font_size]
+
+        def fills(font_size):
+            width, height = text_size(font_size)
+            return (max_width is not None and width >= max_width) or \
+                (max_height is not None and height >= max_height)
+
+        if (max_width is not None and text_size(1)[0] > max_width) or \
+            (max_height is not None and text_size(1)[1] > max_height):
             raise ValueError("Text can't be filled in only (%dpx, %dpx)" % \
-                    text_size)
-        while True:
-            if (max_width is not None and text_size[0] >= max_width) or \
-                (max_height is not None and text_size[1] >= max_height):
-                return font_size - 1
-            font_size += 1
-            text_size = self.get_text_size(font, font_size, text)
+                    text_size(1))
+
+        # The result is one below the smallest size filling the box. Double
+        # the size until the box is filled, then bisect in between. A text
+        # that doesn't fill the box at MAX_FONT_SIZE (e.g. an empty text)
+        # gets MAX_FONT_SIZE itself.
+        low, high = 0, 1
+        while not fills(high):
+            if high >= self.MAX_FONT_SIZE:
+                return self.MAX_FONT_SIZE
+            low, high = high, min(high * 2, self.MAX_FONT_SIZE)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fills(middle):
+                high = middle
+            else:
+                low = middle
+        return high - 1
 
     def write_text(self, img, xy, text, font_filename, font_size=11,
                     color=(0, 0, 0), max_width=None, max_height=None):
@@ -149,107 +234,34 @@ class SimpleLabel:
             font_size = self.get_font_size(text, font_filename, max_width,
                                             max_height)
         text_size = self.get_text_size(font_filename, font_size, text)
-        font = ImageFont.truetype(font_filename, font_size)
+        font = get_font(font_filename, font_size)
         if x == 'center':
             x = (self.size[0] - text_size[0]) / 2
         if y == 'center':
             y = (self.size[1] - text_size[1]) / 2
-        ImageDraw.Draw(img).text((x, y), text, font=font, fill=color)
+        ImageDraw.Draw(img).text((x, y), text, font=font, fill=get_ink(color, img.mode))
         return text_size
 
+    @property
+    def font_path(self):
+        return self._font_path
+
+    def get_qr_image(self, data, error_correction, box_size):
+        """ QR code in the color of the label, see get_qr_image() """
+        return get_qr_image(
+            data,
+            error_correction,
+            box_size,
+            'red' if (255, 0, 0) == self._fore_color else 'black')
+
     def draw_line(self, img, coordinates):
         ImageDraw.Draw(img).line(coordinates, fill="black")
 
     def get_text_size(self, font_filename, font_size, text):
-        font = ImageFont.truetype(font_filename, font_size)
+        font = get_font(font_filename, font_size)
         return font.getsize(text)
 
-    def write_text_box(self, img, xy, text, box_width, font_filename,
-                        font_size=11, color=(0, 0, 0), place='left',
-                        justify_last_line=False, position='top',
-                        line_spacing=1.0, box_height=None):
-        x, y = xy
-
-        while box_height is not None:
-            # This splits text and creates a multi-lin
-            lines = []
-            line = []
-            words = text.split()
-            for word in words:
-                new_line = ' '.join(line + [word])
-                size = self.get_text_size(font_filename, font_size, new_line)
-                text_height = size[1] * line_spacing
-                last_line_bleed = text_height - size[1]
-                if size[0] <= box_width:
-                    line.append(word)
-                else:
-                    lines.append(line)
-                    line = [word]
-            if line:
-                lines.append(line)
-            lines = [' '.join(line) for line in lines if line]
-            
-            if position == 'middle':
-                height = (self.size[1] - len(lines)*text_height + last_line_bleed)/2
-                height -= text_height # the loop below will fix this height
-            elif position == 'bottom':
-                height = self.size[1] - len(lines)*text_height + last_line_bleed
-                height -= text_height  # the loop below will fix this height
-            else:
-                height = y
-                
-            for index, line in enumerate(lines):
-                if place == 'left':
-                    pass
-                elif place == 'right':
-                    total_size = self.get_text_size(font_filename, font_size, line)
-                    x_left = x + box_width - total_size[0]
-                elif place == 'center':
-                    total_size = self.get_text_size(font_filename, font_size, line)
-                    x_left = int(x + ((box_width - total_size[0]) / 2))
-                elif place == 'justify':
-                    words = line.split()
-                    if (index == len(lines) - 1 and not justify_last_line) or \
-                    len(words) == 1:
-                        continue
-                    line_without_spaces = ''.join(words)
-                    total_size = self.get_text_size(font_filename, font_size,
-                                                    line_without_spaces)
-                    space_width = (box_width - total_size[0]) / (len(words) - 1.0)
-                    start_x = x
-                    for word in words[:-1]:
-                        word_size = self.get_text_size(font_filename, font_size,
-                                                        word)
-                        start_x += word_size[0] + space_width
-                    last_word_size = self.get_text_size(font_filename, font_size,
-                                                        words[-1])
-                    last_word_x = x + box_width - last_word_size[0]
-                height += text_height
-
-            if height - y < box_height:
-                box_height=None
-                break
-            else:
-                font_size-=1
-
-        # This splits text and creates a multi-lin
-        lines = []
-        line = []
-        words = text.split()
-        for word in words:
-            new_line = ' '.join(line + [word])
-            size = self.get_text_size(font_filename, font_size, new_line)
-            text_height = size[1] * line_spacing
-            last_line_bleed = text_height - size[1]
-            if size[0] <= box_width:
-                line.append(word)
-            else:
-                lines.append(line)
-                line = [word]
-        if line:
-            lines.append(line)
-        lines = [' '.join(line) for line in lines if line]
-        
+    def _text_box_top(self, y, position, lines, text_height, last_line_bleed):
         if position == 'middle':
             height = (self.size[1] - len(lines)*text_height + last_line_bleed)/2
             height -= text_height # the loop below will fix this height
@@ -258,96 +270,92 @@ class SimpleLabel:
             height -= text_height  # the loop below will fix this height
         else:
             height = y
+        return height
+
+    def write_text_box(self, img, xy, text, box_width, font_filename,
+                        font_size=11, color=(0, 0, 0), place='left',
+                        justify_last_line=False, position='top',
+                        line_spacing=1.0, box_height=None):
+        x, y = xy
+        layouts = {}
+
+        def layout(font_size):
+            if font_size not in layouts:
+                layouts[font_size] = wrap_text(
+                    text, box_width, font_filename, font_size, line_spacing)
+            return layouts[font_size]
+
+        def advancing_lines(lines):
+            # justify doesn't move down after the lines it doesn't stretch
+            if place != 'justify':
+                return len(lines)
+            return sum(1 for index, line in enumerate(lines)
+                       if not ((index == len(lines) - 1 and not justify_last_line)
+                               or len(line.split()) == 1))
+
+        def fits(font_size):
+            lines = layout(font_size)
+            height = self._text_box_top(y, position, lines.lines,
+                                        lines.line_height, lines.last_line_bleed)
+            return height + advancing_lines(lines.lines)*lines.line_height - y < box_height
+
+        # Shrink to the largest font size not higher than box_height. The
+        # height of a size depends on the letters in its last line, larger
+        # sizes may fit again, so the sizes are tried one by one from the top.
+        if box_height is not None:
+            while not fits(font_size):
+                font_size -= 1
+                if font_size <= 0:
+                    raise ValueError("Text can't be fitted in a %dpx high box" % box_height)
+
+        # Drawn as laid out, no line or word is measured again
+        lines = layout(font_size)
+        text_height = lines.line_height
+        height = self._text_box_top(y, position, lines.lines, text_height,
+                                    lines.last_line_bleed)
+        draw = ImageDraw.Draw(img)
+        font = lines.font
+        fill = get_ink(color, img.mode)
 
-        for index, line in enumerate(lines):
-            if place == 'left':
-                self.write_text(img,(x, height), line, font_filename, font_size,
-                                color)
-            elif place == 'right':
-                total_size = self.get_text_size(font_filename, font_size, line)
-                x_left = x + box_width - total_size[0]
-                self.write_text(img,(x_left, height), line, font_filename,
-                                font_size, color)
+        for index, line in enumerate(lines.lines):
+            if place == 'right':
+                draw.text((x + box_width - lines.line_width(index), height),
+                          line, font=font, fill=fill)
             elif place == 'center':
-                total_size = self.get_text_size(font_filename, font_size, line)
-                x_left = int(x + ((box_width - total_size[0]) / 2))
-                self.write_text(img,(x_left, height), line, font_filename,
-                                font_size, color)
+                x_left = int(x + ((box_width - lines.line_width(index)) / 2))
+                draw.text((x_left, height), line, font=font, fill=fill)
             elif place == 'justify':
                 words = line.split()
-                if (index == len(lines) - 1 and not justify_last_line) or \
+                if (index == len(lines.lines) - 1 and not justify_last_line) or \
                 len(words) == 1:
-                    self.write_text(img,(x, height), line, font_filename, font_size,
-                                    color)
+                    draw.text((x, height), line, font=font, fill=fill)
                     continue
                 line_without_spaces = ''.join(words)
-                total_size = self.get_text_size(font_filename, font_size,
-                                                line_without_spaces)
+                total_size = lines.metrics.text_size(line_without_spaces)
                 space_width = (box_width - total_size[0]) / (len(words) - 1.0)
                 start_x = x
                 for word in words[:-1]:
-                    self.write_text(img,(start_x, height), word, font_filename,
-                                    font_size, color)
-                    word_size = self.get_text_size(font_filename, font_size,
-                                                    word)
-                    start_x += word_size[0] + space_width
-                last_word_size = self.get_text_size(font_filename, font_size,
-                                                    words[-1])
-                last_word_x = x + box_width - last_word_size[0]
-                self.write_text(img,(last_word_x, height), words[-1], font_filename,
-                                font_size, color)
+                    draw.text((start_x, height), word, font=font, fill=fill)
+                    start_x += lines.metrics.width(word) + space_width
+                last_word_x = x + box_width - lines.metrics.width(words[-1])
+                draw.text((last_word_x, height), words[-1], font=font, fill=fill)
+            elif place == 'left':
+                draw.text((x, height), line, font=font, fill=fill)
             height += text_height
 
         return (box_width, height - y)
 
-    def _get_partsbox_data(self, config, part_id):
-
-        PARTSBOX_USER_URL = config["PARTSBOX_USER_URL"]
-        PARTSBOX_API_URL = config["PARTSBOX_API_URL"]
-        PARTSBOX_API_KEY = config["PARTSBOX_API_KEY"]
-
-        headers = {"Authorization": "APIKey "+PARTSBOX_API_KEY,"Content-Type": "application/json; charset=utf-8"}
-        data = {"part/id": part_id}
-
-        response = requests.post(PARTSBOX_API_URL+"/part/get", headers=headers, json=data)
-        data=response.json()["data"]
-
-        # Getting stock values per stock location
-        stock_status = {}
-        for item in data["part/stock"]:
-            # if storage location already exist, calcualte the stock level
-            if item["stock/storage-id"] in stock_status:
-                stock_status[item["stock/storage-id"]]+=item["stock/quantity"]
-            # else assing the value
-            else:
-                stock_status[item["stock/storage-id"]]=item["stock/quantity"]
-            #remove locations with 0 stock
-            if stock_status[item["stock/storage-id"]] == 0:
-                del stock_status[item["stock/storage-id"]]
-
-        # Looking up human readable name
-        stock_status_named = {}
-
-        for key, value in stock_status.items():
-            response = requests.post(PARTSBOX_API_URL+"/storage/get", headers=headers, json={"storage/id": key})
-            data_storage = response.json()
-
-            stock_status_named[data_storage["data"]["storage/name"]]=stock_status[key]
-
-        partsbox_fields = {}
-        partsbox_fields["mpn"]=data["part/name"]
-        partsbox_fields["desc"]=data["part/linked-choices"]["description"]
-        partsbox_fields["location"]=str(stock_status_named).replace("{","").replace("}","").replace("'","")
-        partsbox_fields["url"]="https://partsbox.com/irnas/part/"+part_id
-
-        return(partsbox_fields)
-
-    def _generate_partsbox_part(self,img):
-        self._text
-
-        with open('partsbox-config.yaml') as f:
-            config = yaml.load(f, Loader=yaml.FullLoader)
-
+    def _fields_from_text(self, fields, names):
+        """ sets fields[name] from the line of the text for each name, fields
+        without a line keep their placeholder """
+        lines = self._text.splitlines()
+        for name, line in zip(names, lines):
+            fields[name] = line
+        if len(lines) < len(names):
+            logger.debug('No line for %s in the label text, using a placeholder',
+                         ', '.join(names[len(lines):]))
+
+    def _generate_partsbox_part(self, mode):
         partsbox_fields = {}
         # Default values
         partsbox_fields["mpn"]="Placeholder MPN"
@@ -356,158 +364,52 @@ class SimpleLabel:
         partsbox_fields["url"]="https://PARTSBOX.COM/nonenoenoenoenoenoenoenoene"
 
         # Check by length if that is partsbox id
-        if len(self._text) == 26:
-            partsbox_fields=self._get_partsbox_data(config, self._text)
-        elif self._text is not ' ':
-            lines=self._text.splitlines()
-            try:
-                partsbox_fields["mpn"]=lines[0]
-            except:
-                print("Fail")
-            
-            try:
-                partsbox_fields["desc"]=lines[1]
-            except:
-                print("Fail")
-
-            try:
-                partsbox_fields["location"]=lines[2]
-            except:
-                print("Fail")
-
-            try:
-                partsbox_fields["url"]=lines[3]
-            except:
-                print("Fail")
-
-        color = "black"
-        font=self._font_path
-        #font = 'Pillow/Tests/fonts/FreeSans.ttf'
-        width, height = self._width, self._height
-
-        print("width {} height{} ".format(width,height))
-
-        # top row height as percentage of total
-        margin=20
-        top_row_height=int(height*0.25)-margin
-        mid_row_offset=int(height*0.3)+margin
-        mid_row_height=int(height*0.6)-margin
-        bottom_row_offset=int(height*0.8)+margin
-        bottom_row_height=int(height*0.2)-margin
-
-        # Manufacturere part number
-        text_mpn=partsbox_fields["mpn"]
-        text_mpn=textwrap.shorten(text_mpn, width=40, placeholder="...")
-        self.write_text(img,(margin, margin), text_mpn, font_filename=font, font_size='fill', max_width=width, max_height=top_row_height, color=color)
-
-        self.draw_line(img,(margin,mid_row_offset-margin,int(width*0.7),mid_row_offset-margin))
-
-        # Part description - multi line box, autofit
-        text=partsbox_fields["desc"]
-        self.write_text_box(img,(margin, mid_row_offset), text, box_width=int(width-height*0.8), box_height=mid_row_height-10, font_filename=font, font_size=30, color=color, place='left')
-
-        self.draw_line(img,(margin,bottom_row_offset-margin,int(width*0.7),bottom_row_offset-margin))
-
-        # Storage location
-        text=partsbox_fields["location"]
-        text=textwrap.shorten(text, width=50, placeholder="...")
-        self.write_text(img,(margin, bottom_row_offset), text, font_filename=font, font_size='fill', max_width=int(width-height*0.8), max_height=bottom_row_height, color=color)
-
-        text=config["PARTSBOX_COMPANY"]
-        text=textwrap.shorten(text, width=50, placeholder="...")
-        self.write_text(img,(int(width*0.8), int(bottom_row_offset+bottom_row_height/4)), text, font_filename=font, font_size='fill', max_width=int(width-height*0.8), max_height=bottom_row_height/2, color=color)
-
-        # QR code
-        qr = QRCode(
-            version=1,
-            error_correction=constants.ERROR_CORRECT_L,
-            box_size=5,
-            border=0,
-        )
-        qr.add_data(partsbox_fields["url"].lower())
-        qr.make(fit=True)
-        qr_img = qr.make_image(
-            fill_color='red' if (255, 0, 0) == self._fore_color else 'black',
-            back_color="white")
-
-        w, h = qr_img.size
-        img.paste(qr_img,(width-w-20,int(height-h-bottom_row_height)))
-
-        return img
-    
-    def _generate_partsbox_storage(self,img):
-        self._text
-
+        if self._partsbox_fields is not None:
+            partsbox_fields = self._partsbox_fields
+            if hasattr(partsbox_fields, 'result'):
+                partsbox_fields = partsbox_fields.result()
+        elif len(self._text) == 26:
+            if self._partsbox_config is None:
+                raise LookupError("PartsBox is not configured, see partsbox-config.yaml")
+            partsbox_fields=get_client(self._partsbox_config).get_part_fields(self._text)
+        elif self._text != ' ':
+            self._fields_from_text(partsbox_fields, ('mpn', 'desc', 'location', 'url'))
+
+        return PARTSBOX_PART.render(self, mode, dict(
+            partsbox_fields, company=self.label_company))
+
+    def _generate_partsbox_storage(self, mode):
         partsbox_fields = {}
         # Default values
         partsbox_fields["location"]="Placeholder LOCATION"
         partsbox_fields["url"]="https://PARTSBOX.COM/nonenoenoenoenoenoenoenoene"
 
-        if self._text is not ' ':
-            lines=self._text.splitlines()
-            try:
-                partsbox_fields["location"]=lines[0]
-            except:
-                print("Fail")
-
-            try:
-                partsbox_fields["url"]=lines[1]
-            except:
-                print("Fail")
-
-        color = "black"
-        font=self._font_path
-        #font = 'Pillow/Tests/fonts/FreeSans.ttf'
-        width, height = self._width, self._height
-
-        print("width {} height{} ".format(width,height))
-
-        # top row height as percentage of total
-        margin=20
-        top_row_height=int(height*1)-margin
-
-        # Storage location
-        text=partsbox_fields["location"]
-        text=textwrap.shorten(text, width=50, placeholder="...")
-        self.write_text(img,(margin, 0), text, font_filename=font, font_size='fill', max_width=int(width-height*0.8), max_height=top_row_height, color=color)
+        if self._text != ' ':
+            self._fields_from_text(partsbox_fields, ('location', 'url'))
 
-        text="irnas.eu"#self.label_company
-        text=textwrap.shorten(text, width=50, placeholder="...")
-        self.write_text(img,(int(width*0.8), int(0+top_row_height/4)), text, font_filename=font, font_size='fill', max_width=int(width-height*0.8), max_height=top_row_height/2, color=color)
+        return PARTSBOX_STORAGE.render(self, mode, dict(
+            partsbox_fields, company=self.label_company))
 
-        # QR code
-        qr = QRCode(
-            version=1,
-            error_correction=constants.ERROR_CORRECT_L,
-            box_size=5,
-            border=0,
-        )
-        qr.add_data(partsbox_fields["url"].lower())
-        qr.make(fit=True)
-        qr_img = qr.make_image(
-            fill_color='red' if (255, 0, 0) == self._fore_color else 'black',
-            back_color="white")
-
-        w, h = qr_img.size
-        img.paste(qr_img,(width-w-20,int(height-h)))
+    @property
+    def image_mode(self):
+        """ 'L' for black labels, 'RGB' for labels with red on them
 
-        return img
+        Black labels are drawn in greyscale, a third of the memory of RGB,
+        and brother_ql thresholds them without converting them first.
+        """
+        r, g, b = self._fore_color[:3]
+        return 'L' if r == g == b else 'RGB'
 
     def generate(self):
+        mode = self.image_mode
 
         if self._label_content in (LabelContent.PARTSBOX_STORAGE, LabelContent.PARTSBOX_PART):
             if self._label_content is LabelContent.PARTSBOX_PART :
-                width, height = (696, int(696*0.4))
-                self._width, self._height = width, height 
-
-                imgResult = Image.new('RGB', (width, height), 'white')
-                self._generate_partsbox_part(imgResult)
+                self._width, self._height = PARTSBOX_PART.size
+                imgResult = self._generate_partsbox_part(mode)
             elif self._label_content is LabelContent.PARTSBOX_STORAGE :
-                width, height = (696, int(696*0.3))
-                self._width, self._height = width, height 
-
-                imgResult = Image.new('RGB', (width, height), 'white')
-                self._generate_partsbox_storage(imgResult)
+                self._width, self._height = PARTSBOX_STORAGE.size
+                imgResult = self._generate_partsbox_storage(mode)
 
         else:
             if self._label_content in (LabelContent.QRCODE_ONLY, LabelContent.TEXT_QRCODE):
@@ -563,7 +465,7 @@ class SimpleLabel:
             text_offset = horizontal_offset_text, vertical_offset_text
             image_offset = horizontal_offset_image, vertical_offset_image
 
-            imgResult = Image.new('RGB', (width, height), 'white')
+            imgResult = Image.new(mode, (width, height), 'white')
             if img is not None:
                 imgResult.paste(img, image_offset)
 
@@ -572,7 +474,7 @@ class SimpleLabel:
                 draw.multiline_text(
                     text_offset,
                     self._prepare_text(self._text),
-                    self._fore_color,
+                    get_ink(self._fore_color, mode),
                     font=self._get_font(),
                     align=self._text_align,
                     spacing=int(self._font_size*((self._line_spacing - 100) / 100)))
@@ -580,18 +482,7 @@ class SimpleLabel:
         return imgResult
 
     def _generate_qr(self):
-        qr = QRCode(
-            version=1,
-            error_correction=self._qr_correction,
-            box_size=self._qr_size,
-            border=0,
-        )
-        qr.add_data(self._text)
-        qr.make(fit=True)
-        qr_img = qr.make_image(
-            fill_color='red' if (255, 0, 0) == self._fore_color else 'black',
-            back_color="white")
-        return qr_img
+        return self.get_qr_image(self._text, self._qr_correction, self._qr_size)
 
     def _get_text_size(self):
         font = self._get_font()
@@ -614,4 +505,4 @@ class SimpleLabel:
         return '\n'.join(lines)
 
     def _get_font(self):
-        return ImageFont.truetype(self._font_path, self._font_size)
+        return get_font(self._font_path, self._font_size)
@@ -0,0 +1,192 @@
+import textwrap
+
+from PIL import Image
+from qrcode import constants
+
+from app.cache import LRUCache
+
+# Static layers by (template, size, mode, font, static values), see
+# LabelTemplate.static_layer()
+static_layer_cache = LRUCache(maxsize=64, maxbytes=16*1024*1024,
+                              sizeof=lambda im: im.size[0] * im.size[1] * len(im.getbands()))
+
+
+class Line:
+    """ A black line, always part of the static layer """
+
+    field = None
+    static = True
+
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+
+    def draw(self, label, img, values):
+        label.draw_line(img, self.coordinates)
+
+
+class Text:
+    """
+    A single line of text from values[field]
+
+    :param font_size: a size in pixels or 'fill' for the largest size fitting
+                      into max_width and max_height
+    :param shorten: texts longer than this are shortened to fit, with '...'
+    :param optional: nothing is drawn for an empty text
+    :param static: the text is the same on all labels printed with the
+                   template, like the company name
+    """
+
+    def __init__(self, field, xy, font_size='fill', max_width=None,
+                 max_height=None, shorten=None, optional=False, static=False):
+        self.field = field
+        self.xy = xy
+        self.font_size = font_size
+        self.max_width = max_width
+        self.max_height = max_height
+        self.shorten = shorten
+        self.optional = optional
+        self.static = static
+
+    def draw(self, label, img, values):
+        text = values[self.field]
+        if self.shorten:
+            text = textwrap.shorten(text, width=self.shorten, placeholder="...")
+        if self.optional and not text:
+            return
+        label.write_text(img, self.xy, text, font_filename=label.font_path,
+                         font_size=self.font_size, max_width=self.max_width,
+                         max_height=self.max_height, color="black")
+
+
+class TextBox:
+    """ Text from values[field] wrapped into a box, shrunk to fit box_height """
+
+    static = False
+
+    def __init__(self, field, xy, box_width, box_height, font_size,
+                 place='left'):
+        self.field = field
+        self.xy = xy
+        self.box_width = box_width
+        self.box_height = box_height
+        self.font_size = font_size
+        self.place = place
+
+    def draw(self, label, img, values):
+        label.write_text_box(img, self.xy, values[self.field],
+                             box_width=self.box_width, box_height=self.box_height,
+                             font_filename=label.font_path, font_size=self.font_size,
+                             color="black", place=self.place)
+
+
+class QRCode:
+    """ The QR code of values[field] (lowercase), right and bottom are the
+    distances to the edges of the label """
+
+    static = False
+
+    def __init__(self, field, right, bottom, box_size=5):
+        self.field = field
+        self.right = right
+        self.bottom = bottom
+        self.box_size = box_size
+
+    def draw(self, label, img, values):
+        qr_img = label.get_qr_image(values[self.field].lower(),
+                                    constants.ERROR_CORRECT_L, self.box_size)
+        w, h = qr_img.size
+        width, height = img.size
+        img.paste(qr_img, (width-w-self.right, int(height-h-self.bottom)))
+
+
+class LabelTemplate:
+    """
+    A label layout described once
+
+    layout(width, height) returns the elements of the label. The static
+    ones are drawn once per label size, mode, font and static values and
+    cached, labels get a copy with only the other elements drawn onto it.
+    """
+
+    def __init__(self, name, size, layout):
+        self.name = name
+        self.size = size
+        self.elements = layout(*size)
+
+    def static_layer(self, label, mode, values):
+        static_values = tuple(
+            (element.field, values[element.field]) for element in self.elements
+            if element.static and element.field)
+        key = (self.name, self.size, mode, label.font_path, static_values)
+
+        def draw():
+            img = Image.new(mode, self.size, 'white')
+            for element in self.elements:
+                if element.static:
+                    element.draw(label, img, values)
+            return img
+
+        return static_layer_cache.get_or_create(key, draw)
+
+    def render(self, label, mode, values):
+        """ draws a label
+        :param label: SimpleLabel with the font and colors to use
+        :param values: text of each field
+        :return: new image of self.size
+        """
+        img = self.static_layer(label, mode, values).copy()
+        for element in self.elements:
+            if not element.static:
+                element.draw(label, img, values)
+        return img
+
+
+def _partsbox_part_layout(width, height):
+    # top row height as percentage of total
+    margin = 20
+    top_row_height = int(height*0.25)-margin
+    mid_row_offset = int(height*0.3)+margin
+    mid_row_height = int(height*0.6)-margin
+    bottom_row_offset = int(height*0.8)+margin
+    bottom_row_height = int(height*0.2)-margin
+    text_width = int(width-height*0.8)
+
+    return [
+        # Manufacturer part number
+        Text('mpn', (margin, margin), max_width=width,
+             max_height=top_row_height, shorten=40),
+        Line((margin, mid_row_offset-margin, int(width*0.7), mid_row_offset-margin)),
+        # Part description - multi line box, autofit
+        TextBox('desc', (margin, mid_row_offset), box_width=text_width,
+                box_height=mid_row_height-10, font_size=30),
+        Line((margin, bottom_row_offset-margin, int(width*0.7), bottom_row_offset-margin)),
+        # Storage location
+        Text('location', (margin, bottom_row_offset), max_width=text_width,
+             max_height=bottom_row_height, shorten=50),
+        Text('company', (int(width*0.8), int(bottom_row_offset+bottom_row_height/4)),
+             max_width=text_width, max_height=bottom_row_height/2, shorten=50,
+             optional=True, static=True),
+        QRCode('url', right=20, bottom=bottom_row_height),
+    ]
+
+
+def _partsbox_storage_layout(width, height):
+    margin = 20
+    top_row_height = int(height*1)-margin
+    text_width = int(width-height*0.8)
+
+    return [
+        # Storage location
+        Text('location', (margin, 0), max_width=text_width,
+             max_height=top_row_height, shorten=50),
+        Text('company', (int(width*0.8), int(0+top_row_height/4)),
+             max_width=text_width, max_height=top_row_height/2, shorten=50,
+             optional=True, static=True),
+        QRCode('url', right=20, bottom=0),
+    ]
+
+
+PARTSBOX_PART = LabelTemplate(
+    'partsbox_part', (696, int(696*0.4)), _partsbox_part_layout)
+PARTSBOX_STORAGE = LabelTemplate(
+    'partsbox_storage', (696, int(696*0.3)), _partsbox_storage_layout)
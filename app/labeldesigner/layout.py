@@ -0,0 +1,143 @@
+from app.cache import LRUCache
+from app.fonts import get_font
+
+# Measured widths are rounded to pixels, wrapping decisions closer than this
+# to the box width are checked by measuring the whole line
+_TOLERANCE = 2
+
+# Words remembered per font and size, mail merges may bring many new ones
+MAX_WORDS = 10000
+
+
+class FontMetrics:
+    """
+    Sizes of words and spaces in one font and size, each measured once
+
+    Word boxes are relative to the pen position the word is drawn at, the
+    kerning between the last letter of a word and a space (and a space and
+    the first letter of the next word) is measured once per letter pair.
+    """
+
+    def __init__(self, font_path, font_size):
+        self.font = get_font(font_path, font_size)
+        self.space = self.font.getlength(' ')
+        self._words = {}
+        self._kerning = {}
+
+    def word(self, word):
+        """ :return: (advance, left, right, bottom) of word drawn at 0 """
+        metrics = self._words.get(word)
+        if metrics is None:
+            if len(self._words) >= MAX_WORDS:
+                self._words.clear()
+            left, top, right, bottom = self.font.getbbox(word)
+            metrics = (self.font.getlength(word), left, right, bottom)
+            self._words[word] = metrics
+        return metrics
+
+    def kerning(self, first, second):
+        """ offset between the letters first and second, mostly 0 """
+        pair = first + second
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            kerning = self.font.getlength(pair) - \
+                self.font.getlength(first) - self.font.getlength(second)
+            self._kerning[pair] = kerning
+        return kerning
+
+    def width(self, word):
+        """ width of a single word, the same as font.getsize(word)[0] """
+        advance, left, right, bottom = self.word(word)
+        return right - left
+
+    def text_size(self, text):
+        return self.font.getsize(text)
+
+
+# FontMetrics by (font path, font size)
+metrics_cache = LRUCache(maxsize=64)
+
+
+def get_metrics(font_path, font_size):
+    return metrics_cache.get_or_create(
+        (font_path, font_size), lambda: FontMetrics(font_path, font_size))
+
+
+class TextLayout:
+    """
+    A text broken into lines, as drawn by SimpleLabel.write_text_box()
+
+    line_height is the distance between the tops of two lines, the last
+    line is last_line_bleed shorter as there is no spacing below it.
+    """
+
+    def __init__(self, metrics, lines, line_height, last_line_bleed):
+        self.metrics = metrics
+        self.lines = lines
+        self.line_height = line_height
+        self.last_line_bleed = last_line_bleed
+        self._widths = {}
+
+    @property
+    def font(self):
+        return self.metrics.font
+
+    def line_width(self, index):
+        """ width of a line, measured once when first needed """
+        width = self._widths.get(index)
+        if width is None:
+            width = self._widths[index] = \
+                self.metrics.text_size(self.lines[index])[0]
+        return width
+
+
+def wrap_text(text, box_width, font_path, font_size, line_spacing=1.0):
+    """
+    Breaks text into lines not wider than box_width, a word is moved to the
+    next line if it doesn't fit. Single words wider than the box get a line
+    of their own.
+
+    Each word is measured once and the width of a line is added up as words
+    are appended, which takes linear time instead of measuring every line
+    again for each word.
+    :return: TextLayout
+    """
+    metrics = get_metrics(font_path, font_size)
+    lines = []
+    line = []
+    # of the words in line: pen position after them and their ink box
+    pen = left = right = bottom = 0
+    line_height = last_line_bleed = 0
+
+    for word in text.split():
+        advance, word_left, word_right, word_bottom = metrics.word(word)
+        if line:
+            x = pen + metrics.kerning(line[-1][-1], ' ') + metrics.space + \
+                metrics.kerning(' ', word[0])
+            new_left = min(left, x + word_left)
+            new_right = max(right, x + word_right)
+            new_bottom = max(bottom, word_bottom)
+            width = new_right - new_left
+            if abs(width - box_width) <= _TOLERANCE:
+                width = metrics.text_size(' '.join(line + [word]))[0]
+        else:
+            x = 0
+            new_left, new_right, new_bottom = word_left, word_right, word_bottom
+            width = word_right - word_left
+
+        # the spacing of the last line tried, like the whole text was one
+        line_height = new_bottom * line_spacing
+        last_line_bleed = line_height - new_bottom
+
+        if width <= box_width:
+            line.append(word)
+            pen, left, right, bottom = x + advance, new_left, new_right, new_bottom
+        else:
+            if line:
+                lines.append(' '.join(line))
+            line = [word]
+            pen, left, right, bottom = advance, word_left, word_right, word_bottom
+    if line:
+        lines.append(' '.join(line))
+
+    return TextLayout(metrics, lines, line_height, last_line_bleed)
@@ -0,0 +1,98 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_session_id_re = re.compile(r'^[0-9A-Za-z_-]{8,64}$')
+
+
+class LivePreviewSession:
+    """
+    The label being edited in one browser tab
+
+    Each update replaces the previous state, the preview stream of the
+    session renders only the latest one.
+    """
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.values = None
+        self.version = 0
+        self.last_seen = time.monotonic()
+        self._changed = threading.Condition()
+
+    def update(self, values):
+        """ replaces the label parameters
+        :return: the version of the new state
+        """
+        with self._changed:
+            self.values = values
+            self.version += 1
+            self.last_seen = time.monotonic()
+            self._changed.notify_all()
+            return self.version
+
+    def wait_for_update(self, version, timeout=None):
+        """ blocks until a state newer than version was posted
+        :return: (version, values) of the latest state, the version is
+                 unchanged if the wait timed out
+        """
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            self.last_seen = time.monotonic()
+            return self.version, self.values
+
+
+class LivePreviews:
+    """ The live preview sessions, idle ones are dropped after idle_timeout seconds """
+
+    def __init__(self, max_sessions=256, idle_timeout=600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.renders = 0
+        self.skipped = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """ returns the session, a new one if it doesn't exist yet """
+        if not _session_id_re.match(session_id or ''):
+            raise ValueError('Invalid live preview session id')
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._prune()
+                session = LivePreviewSession(session_id)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count_render(self, version, previous_version):
+        """ counts a render of version and the states it superseded """
+        with self._lock:
+            self.renders += 1
+            self.skipped += max(0, version - previous_version - 1)
+
+    def info(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'renders': self.renders,
+                'skipped': self.skipped,
+            }
+
+    def _prune(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+
+
+live_previews = LivePreviews()
@@ -0,0 +1,102 @@
+import copy
+import csv
+import os
+import re
+import shutil
+import tempfile
+
+from .printer import PrinterQueue
+from .render import render_pool
+
+# {column} in the text of the template label
+_placeholder_re = re.compile(r'\{([^{}]+)\}')
+
+
+def placeholders(text):
+    """ the set of column names used as {column} in text """
+    return set(_placeholder_re.findall(text or ''))
+
+
+def fill_placeholders(text, row):
+    """ replaces each {column} in text by the value of the column in row """
+    return _placeholder_re.sub(lambda match: row[match.group(1)] or '', text)
+
+
+def save_csv(file):
+    """ copies an uploaded CSV file to a temporary file
+    :return: path of the temporary file, deleted once the rows were printed
+    """
+    fd, path = tempfile.mkstemp(prefix='mailmerge-', suffix='.csv')
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(file.stream, f)
+    return path
+
+
+class CsvRows:
+    """ The rows of a CSV file as dicts, read one at a time """
+
+    def __init__(self, path):
+        self.path = path
+        with self._open() as f:
+            sample = f.read(4096)
+            try:
+                self.dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                self.dialect = csv.excel
+            f.seek(0)
+            reader = csv.DictReader(f, dialect=self.dialect)
+            self.fieldnames = reader.fieldnames or []
+            self.count = sum(1 for row in reader)
+
+    def _open(self):
+        # utf-8-sig drops the byte order mark some spreadsheets write
+        return open(self.path, newline='', encoding='utf-8-sig')
+
+    def __iter__(self):
+        with self._open() as f:
+            yield from csv.DictReader(f, dialect=self.dialect)
+
+
+class MailMergeQueue(PrinterQueue):
+    """
+    Prints one label per row of a CSV file
+
+    Rows are read, rendered and streamed to the printer one at a time, so
+    the memory used doesn't depend on the number of rows.
+    """
+
+    def __init__(self, model, device_specifier, label_size, template, csv_path,
+                 count=1, cut_once=False):
+        super().__init__(model, device_specifier, label_size)
+        self.template = template
+        self.rows = CsvRows(csv_path)
+        self.count = count
+        self.cut_once = cut_once
+
+        missing = placeholders(template.text) - set(self.rows.fieldnames)
+        if missing:
+            raise ValueError('The CSV file has no column {}'.format(
+                ', '.join(sorted(missing))))
+
+    def labels(self):
+        for row in self.rows:
+            label = copy.copy(self.template)
+            if self.template.text:
+                label.text = fill_placeholders(self.template.text, row)
+            yield label
+
+    def rasters(self):
+        """ the rasters of each row, see rasterize_label() """
+        entries = ((label, self.count, self.cut_once) for label in self.labels())
+        return render_pool.rasterize(entries, self._model, self.label_size,
+                                     size=self.rows.count)
+
+    def process_queue(self, on_state=None, on_progress=None):
+        on_state = on_state or (lambda state: None)
+        on_progress = on_progress or (lambda done, total: None)
+
+        try:
+            self._stream(self.rasters(), self.rows.count * self.count,
+                         on_state, on_progress)
+        finally:
+            os.remove(self.rows.path)
@@ -0,0 +1,231 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class PartsBoxClient:
+    """
+    Client for the PartsBox API
+
+    Requests go through one pooled HTTP session, storage names of a part are
+    looked up concurrently and parts and storage names are cached for ttl
+    seconds (see invalidate()).
+    """
+
+    def __init__(self, api_url, api_key, user_url='', timeout=10, ttl=300,
+                 max_workers=8):
+        self.api_url = api_url.rstrip('/')
+        self.user_url = user_url.rstrip('/')
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': 'APIKey ' + api_key,
+            'Content-Type': 'application/json; charset=utf-8',
+        })
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='partsbox')
+        # separate pool, its tasks wait for storage lookups on the other one
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers // 2),
+            thread_name_prefix='partsbox-prefetch')
+        self._parts = LRUCache(maxsize=1024, ttl=ttl)
+        self._storage_names = LRUCache(maxsize=1024, ttl=ttl)
+
+    def _post(self, operation, payload):
+        response = self.session.post(self.api_url + '/' + operation,
+                                     json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        try:
+            return response.json()['data']
+        except (ValueError, KeyError):
+            raise LookupError('PartsBox {} returned no data for {}'.format(
+                operation, payload))
+
+    def get_part(self, part_id):
+        return self._parts.get_or_create(
+            part_id, lambda: self._post('part/get', {'part/id': part_id}))
+
+    def get_storage_name(self, storage_id):
+        return self._storage_names.get_or_create(
+            storage_id,
+            lambda: self._post('storage/get', {'storage/id': storage_id})['storage/name'])
+
+    def get_part_fields(self, part_id):
+        """ fetches the label fields of a part
+        :param part_id: 26 character PartsBox part id
+        :return: dict with mpn, desc, location and url
+        """
+        data = self.get_part(part_id)
+
+        # Getting stock values per stock location
+        stock_status = {}
+        for item in data["part/stock"]:
+            # if storage location already exist, calcualte the stock level
+            if item["stock/storage-id"] in stock_status:
+                stock_status[item["stock/storage-id"]]+=item["stock/quantity"]
+            # else assing the value
+            else:
+                stock_status[item["stock/storage-id"]]=item["stock/quantity"]
+            #remove locations with 0 stock
+            if stock_status[item["stock/storage-id"]] == 0:
+                del stock_status[item["stock/storage-id"]]
+
+        # Looking up human readable names, all locations at once
+        names = self._executor.map(self.get_storage_name, stock_status.keys())
+        stock_status_named = dict(zip(names, stock_status.values()))
+
+        partsbox_fields = {}
+        partsbox_fields["mpn"]=data["part/name"]
+        partsbox_fields["desc"]=data["part/linked-choices"]["description"]
+        partsbox_fields["location"]=str(stock_status_named).replace("{","").replace("}","").replace("'","")
+        partsbox_fields["url"]=self.user_url+"/part/"+part_id
+
+        return partsbox_fields
+
+    def prefetch_part_fields(self, part_ids):
+        """ starts fetching the label fields of many parts in the background
+        :param part_ids: list of PartsBox part ids
+        :return: list of futures of get_part_fields(), in the order of part_ids
+        """
+        return [self._prefetch_executor.submit(self.get_part_fields, part_id)
+                for part_id in part_ids]
+
+    def get_storage_part_ids(self, storage_id):
+        """ ids of the parts stocked in a storage location, in API order """
+        part_ids = []
+        for item in self._post('storage/parts', {'storage/id': storage_id}):
+            part_id = item.get('stock/part-id', item.get('part/id'))
+            if part_id is not None and part_id not in part_ids:
+                part_ids.append(part_id)
+        return part_ids
+
+    def invalidate(self, part_id=None, storage_id=None):
+        """ drops cached data, everything if neither part_id nor storage_id is given """
+        if part_id is None and storage_id is None:
+            self._parts.clear()
+            self._storage_names.clear()
+        if part_id is not None:
+            self._parts.invalidate(part_id)
+        if storage_id is not None:
+            self._storage_names.invalidate(storage_id)
+
+    def info(self):
+        return {
+            'parts': self._parts.info(),
+            'storage_names': self._storage_names.info(),
+        }
+
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def load_config(path='partsbox-config.yaml'):
+    with open(path) as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+class PartsBoxConfig:
+    """
+    The settings of partsbox-config.yaml, parsed once and parsed again only
+    when the modification time of the file changed. The file is checked at
+    most every check_interval seconds.
+    """
+
+    REQUIRED_KEYS = ('PARTSBOX_USER_URL', 'PARTSBOX_API_URL',
+                     'PARTSBOX_API_KEY', 'PARTSBOX_COMPANY')
+
+    def __init__(self, path='partsbox-config.yaml', check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.settings = None
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def validate(settings):
+        """ returns a list of problems with the settings, empty if they are fine """
+        if not isinstance(settings, dict):
+            return ['expected a mapping of PARTSBOX_* settings']
+        return ['{} is missing'.format(key)
+                for key in PartsBoxConfig.REQUIRED_KEYS if not settings.get(key)]
+
+    def load(self):
+        """ (re)loads the file, keeps the previous settings if it is invalid
+        :return: the current settings, None if there are none
+        """
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                if self._mtime is not None or self.settings is None:
+                    logger.warning('PartsBox configuration %s not found, '
+                                   'PartsBox part ids can not be looked up', self.path)
+                self._mtime = None
+                return self.settings
+
+            if mtime == self._mtime:
+                return self.settings
+            self._mtime = mtime
+
+            try:
+                settings = load_config(self.path)
+            except (OSError, yaml.YAMLError) as e:
+                logger.error('Could not read PartsBox configuration %s: %s', self.path, e)
+                return self.settings
+
+            problems = self.validate(settings)
+            if problems:
+                logger.error('Invalid PartsBox configuration %s: %s',
+                             self.path, ', '.join(problems))
+                return self.settings
+
+            self.settings = settings
+            logger.info('Loaded PartsBox configuration %s', self.path)
+            return self.settings
+
+    def reload_if_changed(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return self.settings
+        return self.load()
+
+
+def get_client(config):
+    """ returns the shared client for a PartsBox configuration
+    :param config: dict with the PARTSBOX_* settings of partsbox-config.yaml
+    """
+    key = (config["PARTSBOX_API_URL"], config["PARTSBOX_API_KEY"],
+           config["PARTSBOX_USER_URL"])
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = PartsBoxClient(
+                api_url=config["PARTSBOX_API_URL"],
+                api_key=config["PARTSBOX_API_KEY"],
+                user_url=config["PARTSBOX_USER_URL"],
+                timeout=config.get("PARTSBOX_TIMEOUT", 10),
+                ttl=config.get("PARTSBOX_CACHE_TTL", 300))
+            _clients[key] = client
+        return client
+
+
+def get_clients():
+    with _lock:
+        return list(_clients.values())
@@ -0,0 +1,109 @@
+import threading
+
+from brother_ql.backends import guess_backend
+from brother_ql.devicedependent import label_sizes, models
+
+from .spooler import get_spooler
+
+
+class PoolPrinter:
+    """ A printer of the pool and the labels loaded into it """
+
+    def __init__(self, name, model, device_specifier, label_size=None):
+        if model not in models:
+            raise ValueError('Printer {}: unknown model {}'.format(name, model))
+        if label_size is not None and label_size not in label_sizes:
+            raise ValueError('Printer {}: unknown label size {}'.format(name, label_size))
+        # raises a ValueError for unsupported device specifiers
+        guess_backend(device_specifier)
+        self.name = name
+        self.model = model
+        self.device_specifier = device_specifier
+        self.label_size = label_size
+
+    @property
+    def spooler(self):
+        return get_spooler(self.device_specifier)
+
+    def accepts(self, label_size):
+        """ True if the printer can print labels of this size, any if label_size is None """
+        return self.label_size is None or self.label_size == label_size
+
+    def info(self):
+        spooler = self.spooler
+        return {
+            'name': self.name,
+            'model': self.model,
+            'device': self.device_specifier,
+            'label_size': self.label_size,
+            'queued': spooler.pending(),
+            'busy': spooler.busy,
+            'jobs_done': spooler.jobs_done,
+            'jobs_failed': spooler.jobs_failed,
+            'utilization': spooler.utilization(),
+        }
+
+
+class PrinterPool:
+    """
+    The configured printers, see PRINTERS in config.py
+
+    Each print job is routed to the least loaded printer that has the labels
+    of the job loaded, ties go to the printer configured first.
+    """
+
+    def __init__(self):
+        self._printers = []
+        self._lock = threading.Lock()
+
+    @property
+    def printers(self):
+        return list(self._printers)
+
+    def configure(self, printers):
+        """ replaces the printers of the pool
+        :param printers: list of dicts with name, model, device and label_size
+        """
+        pool = []
+        for number, printer in enumerate(printers, 1):
+            name = printer.get('name') or 'printer {}'.format(number)
+            if any(p.name == name for p in pool):
+                raise ValueError('Printer name {} is used twice'.format(name))
+            pool.append(PoolPrinter(name, printer['model'], printer['device'],
+                                    printer.get('label_size')))
+        with self._lock:
+            self._printers = pool
+
+    def select(self, label_size, name=None):
+        """ picks the printer for a job
+
+        The balancing is best-effort: the job is only queued once its labels
+        are created, jobs selecting a printer meanwhile see the same loads
+        and may all go to the same printer.
+        :param label_size: label size of the job
+        :param name: use this printer instead of the least loaded one
+        :return: PoolPrinter
+        """
+        with self._lock:
+            candidates = [printer for printer in self._printers
+                          if printer.accepts(label_size)
+                          and (name is None or printer.name == name)]
+            if not candidates:
+                if name is not None:
+                    raise LookupError('No printer {} with {} labels loaded'.format(
+                        name, label_size))
+                raise LookupError('No printer with {} labels loaded'.format(label_size))
+            return min(candidates, key=lambda printer: printer.spooler.load())
+
+    def info(self):
+        printers = [printer.info() for printer in self.printers]
+        return {
+            'printers': printers,
+            'queued': sum(printer['queued'] for printer in printers),
+            'busy': sum(1 for printer in printers if printer['busy']),
+            'utilization': sum(printer['utilization'] for printer in printers)
+                           / len(printers) if printers else 0.0,
+        }
+
+
+printer_pool = PrinterPool()
@@ -1,21 +1,28 @@
-from brother_ql.backends import backend_factory, guess_backend
-from brother_ql import BrotherQLRaster, create_label
-from .label import LabelOrientation, LabelType
+import queue
+import threading
 
+from brother_ql.backends import guess_backend
+from .spooler import JobState
+from .backends import backend_manager
+from .render import render_pool
+
+# Rendered labels waiting to be sent to the printer while streaming
+STREAM_QUEUE_SIZE = 4
 
-class PrinterQueue:
 
-    _printQueue = []
-    _cutQueue = []
+class PrinterQueue:
 
     def __init__(
             self,
             model,
             device_specifier,
-            label_size):
+            label_size,
+            streaming=True):
+        self._printQueue = []
         self.model = model
         self.device_specifier = device_specifier
         self.label_size = label_size
+        self.streaming = streaming
 
     @property
     def model(self):
@@ -31,10 +38,9 @@ class PrinterQueue:
 
     @device_specifier.setter
     def device_specifier(self, value):
+        # raises a ValueError for unsupported device specifiers
+        guess_backend(value)
         self._device_specifier = value
-        selected_backend = guess_backend(self._device_specifier)
-        self._backend_class = backend_factory(
-            selected_backend)['backend_class']
 
     @property
     def label_size(self):
@@ -45,40 +51,105 @@ class PrinterQueue:
         self._label_size = value
 
     def add_label_to_queue(self, label, count, cut_once=False):
-        for cnt in range(0, count):
-            cut = (cut_once == False) or (cut_once and cnt == count-1)
-            cut = True
-
-            self._printQueue.append(
-                {'label': label,
-                 'cut': cut
-                 })
-
-    def process_queue(self):
-        qlr = BrotherQLRaster(self._model)
-
-        for queue_entry in self._printQueue:
-            if queue_entry['label'].label_type == LabelType.ENDLESS_LABEL:
-                if queue_entry['label'].label_orientation == LabelOrientation.STANDARD:
-                    rotate = 0
-                else:
-                    rotate = 90
-            else:
-                rotate = 'auto'
-
-            img = queue_entry['label'].generate()
-
-            create_label(
-                qlr,
-                img,
-                self.label_size,
-                red='red' in self.label_size,
-                cut=queue_entry['cut'],
-                rotate=rotate)
-
+        self._printQueue.append(
+            {'label': label,
+             'count': count,
+             'cut_once': cut_once
+             })
+
+    def process_queue(self, on_state=None, on_progress=None):
+        on_state = on_state or (lambda state: None)
+        on_progress = on_progress or (lambda done, total: None)
+
+        total = sum(queue_entry['count'] for queue_entry in self._printQueue)
+        entries = [(queue_entry['label'], queue_entry['count'], queue_entry['cut_once'])
+                   for queue_entry in self._printQueue]
         self._printQueue.clear()
-
-        be = self._backend_class(self._device_specifier)
-        be.write(qlr.data)
-        be.dispose()
-        del be
+        rasters = render_pool.rasterize(entries, self._model, self.label_size)
+
+        if self.streaming:
+            self._stream(rasters, total, on_state, on_progress)
+            return
+
+        data = bytearray()
+
+        on_state(JobState.RENDERING)
+        done = 0
+        for runs in numbered(rasters):
+            for raster, copies in runs:
+                for _ in range(copies):
+                    data += raster
+                    done += 1
+                    on_progress(done, total)
+
+        on_state(JobState.SENDING)
+        backend_manager.write(self._device_specifier, data)
+
+    def _stream(self, rasters, total, on_state, on_progress):
+        """ sends the raster data of each label as soon as it is rendered
+
+        Labels are rendered by a separate thread, at most STREAM_QUEUE_SIZE
+        ahead of the printer, while the connection to the printer is held.
+        The copies of a label are written one by one from the same data.
+        :param rasters: iterable of the rasters of each label, see
+                        rasterize_label()
+        """
+        ready = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        def render():
+            try:
+                for runs in numbered(rasters):
+                    if stop.is_set():
+                        return
+                    put(runs)
+            except Exception as e:
+                put(e)
+            else:
+                put(None)
+
+        renderer = threading.Thread(
+            target=render,
+            name='render {}'.format(self._device_specifier),
+            daemon=True)
+        on_state(JobState.RENDERING)
+        renderer.start()
+
+        done = 0
+        try:
+            with backend_manager.get(self._device_specifier).session() as backend:
+                while True:
+                    runs = ready.get()
+                    if runs is None:
+                        break
+                    if isinstance(runs, Exception):
+                        raise runs
+                    for raster, copies in runs:
+                        for _ in range(copies):
+                            if done == 0:
+                                on_state(JobState.SENDING)
+                            backend.write(raster)
+                            done += 1
+                            on_progress(done, total)
+        finally:
+            stop.set()
+            renderer.join()
+
+
+def numbered(rasters):
+    """ passes the rasters of each label through, an error while rendering
+    tells the number of the label it happened at """
+    number = 0
+    try:
+        for number, runs in enumerate(rasters, 1):
+            yield runs
+    except Exception as e:
+        raise RuntimeError('Label {} of the job failed: {}'.format(number + 1, e)) from e
@@ -0,0 +1,174 @@
+import os
+import copy
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from brother_ql import BrotherQLRaster, create_label
+
+from app.fonts import get_font
+from .conversion import create_two_color_label
+from .label import LabelOrientation, LabelType
+
+logger = logging.getLogger(__name__)
+
+
+def get_rotation(label):
+    """ the rotate argument of brother_ql's create_label for a label """
+    if label.label_type == LabelType.ENDLESS_LABEL:
+        if label.label_orientation == LabelOrientation.STANDARD:
+            return 0
+        return 90
+    return 'auto'
+
+
+def rasterize_label(label, model, label_size, count=1, cut_once=False):
+    """ renders a label and converts it to printer instructions
+
+    The copies of a label only differ by the cut flag, the instructions of
+    each flag are created once and written again for every copy.
+    :param count: number of copies
+    :param cut_once: cut after the last copy only
+    :return: list of (raster data of one copy, number of copies), in the
+             order they are printed
+    """
+    img = label.generate()
+    rotate = get_rotation(label)
+
+    def rasterize(cut):
+        qlr = BrotherQLRaster(model)
+        if 'red' in label_size:
+            create_two_color_label(qlr, img, label_size, cut=cut, rotate=rotate)
+        else:
+            create_label(qlr, img, label_size, cut=cut, rotate=rotate)
+        return bytes(qlr.data)
+
+    if count < 1:
+        return []
+    if cut_once and count > 1:
+        return [(rasterize(False), count - 1), (rasterize(True), 1)]
+    return [(rasterize(True), count)]
+
+
+class RenderedLabel:
+    """ A label generated beforehand, printed without rendering it again """
+
+    partsbox_fields = None
+
+    def __init__(self, label, image):
+        self.label_type = label.label_type
+        self.label_orientation = label.label_orientation
+        self._image = image
+
+    def generate(self):
+        return self._image
+
+
+def _resolve(label):
+    # PartsBox data still being fetched can't be sent to another process
+    fields = label.partsbox_fields
+    if hasattr(fields, 'result'):
+        label = copy.copy(label)
+        label.partsbox_fields = fields.result()
+    return label
+
+
+def _init_worker(font_paths, font_size):
+    for font_path in font_paths:
+        try:
+            get_font(font_path, font_size)
+        except OSError as e:
+            logger.warning('Could not preload font %s: %s', font_path, e)
+
+
+def _ready():
+    return os.getpid()
+
+
+class RenderPool:
+    """
+    Worker processes rendering the labels of large print jobs on all cores
+
+    Jobs with at least threshold different labels are spread over the
+    workers, the results come back in the order of the job. Smaller jobs,
+    and all jobs if there is only one core, are rendered in the calling
+    thread. The workers are forked once at startup with the fonts preloaded,
+    before the server starts any thread.
+    """
+
+    def __init__(self, workers=0, threshold=4):
+        self.workers = workers
+        self.threshold = threshold
+        self._executor = None
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self, font_paths=(), font_size=70):
+        """ starts the workers, does nothing for a single worker
+        :param font_paths: fonts loaded by each worker right away
+        :param font_size: size the fonts are loaded at
+        """
+        workers = self.workers or os.cpu_count() or 1
+        if workers < 2 or self._executor is not None:
+            return
+        if threading.active_count() > 1:
+            # a forked child only has the forking thread, locks held by the
+            # others stay locked forever
+            logger.warning('Not starting render workers, the server already runs threads')
+            return
+        # forked workers have the modules and fonts of the server loaded
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(list(font_paths), font_size))
+        # the first task forks all workers, don't wait for the first job
+        self._executor.submit(_ready)
+        self._lookahead = 2 * workers
+        logger.info('Started %d render workers', workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def rasterize(self, entries, model, label_size, size=None):
+        """ renders labels to printer instructions
+        :param entries: (label, count, cut_once) tuples, see rasterize_label()
+        :param size: number of entries, if entries has no len()
+        :return: generator of the rasters of each entry, in order, see
+                 rasterize_label()
+        """
+        executor = self._executor
+        if size is None:
+            size = len(entries)
+        if executor is None or size < self.threshold:
+            for label, count, cut_once in entries:
+                yield rasterize_label(label, model, label_size, count, cut_once)
+            return
+
+        pending = deque()
+        try:
+            for label, count, cut_once in entries:
+                pending.append(executor.submit(
+                    rasterize_label, _resolve(label), model, label_size, count, cut_once))
+                # stay a few labels ahead of the printer, not a whole job
+                if len(pending) >= self._lookahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            logger.error('A render worker died, rendering in the server process from now on')
+            self._executor = None
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+render_pool = RenderPool()
@@ -1,22 +1,64 @@
 import os
+import re
+import copy
+import json
+import base64
+import hashlib
+from io import BytesIO
 
-from flask import current_app, render_template, request, make_response
+from flask import current_app, render_template, request, make_response, Response, \
+    stream_with_context, url_for
 
 from brother_ql.devicedependent import label_type_specs, label_sizes
 from brother_ql.devicedependent import ENDLESS_LABEL, DIE_CUT_LABEL, ROUND_DIE_CUT_LABEL
 
 from . import bp
-from app.utils import convert_image_to_bw, pdffile_to_image, imgfile_to_image, image_to_png_bytes
+from PIL import Image, features
+from werkzeug.datastructures import FileStorage
+
+from app.utils import convert_image_to_bw, pdffile_to_image, imgfile_to_image, \
+    image_to_print_colors, image_to_compact_bytes
 from app import FONTS
+from app.fonts import font_cache
+from app.cache import LRUCache
 
-from .label import SimpleLabel, LabelContent, LabelOrientation, LabelType
+from .label import SimpleLabel, LabelContent, LabelOrientation, LabelType, qr_cache
+from .label_templates import static_layer_cache
 from .printer import PrinterQueue
+from .spooler import submit_job, get_job
+from .assets import AssetStore, UnknownAssetError, BW_THRESHOLD
+from .partsbox import get_client, get_clients, PartsBoxConfig
+from .backends import backend_manager
+from .pool import printer_pool
+from .mailmerge import MailMergeQueue, save_csv
+from .live import live_previews
+from .render import RenderedLabel
 
 LINE_SPACINGS = (100, 150, 200, 250, 300)
 
 # Don't change as brother_ql is using this DPI value
 DEFAULT_DPI = 300
 
+# Draft previews (draft=1) are scaled down by this factor
+DRAFT_SCALE = 0.5
+
+# Seconds browsers may reuse the styles of a font without asking
+FONT_STYLES_MAX_AGE = 300
+
+# One of each kind of label is rendered by warm_up()
+WARM_UP_PRINT_TYPES = ('text', 'qrcode', 'qrcode_text', 'image',
+                       'partsbox_part', 'partsbox_storage')
+
+# Encoded previews by a digest of the label parameters, see get_preview_key()
+preview_cache = LRUCache(maxsize=1024, maxbytes=32*1024*1024,
+                         sizeof=lambda preview: len(preview[0]))
+
+# partsbox-config.yaml, current settings are in app.config['PARTSBOX']
+partsbox_config = PartsBoxConfig()
+
+# Uploaded images and PDFs, see /api/asset
+asset_store = AssetStore(dpi=DEFAULT_DPI)
+
 LABEL_SIZES = [(
     name,
     label_type_specs[name]['name'],
@@ -25,6 +67,47 @@ LABEL_SIZES = [(
 ) for name in label_sizes]
 
 
+@bp.record_once
+def configure_caches(state):
+    preview_cache.maxbytes = state.app.config['PREVIEW_CACHE_BYTES']
+    preview_cache.ttl = state.app.config['PREVIEW_CACHE_TTL']
+    asset_store.folder = state.app.config['ASSET_FOLDER'] or \
+        os.path.join(state.app.instance_path, 'assets')
+    asset_store.maxbytes = state.app.config['ASSET_STORE_BYTES']
+    asset_store.memory_maxbytes = state.app.config['ASSET_CACHE_BYTES']
+
+
+@bp.record_once
+def configure_backends(state):
+    backend_manager.idle_timeout = state.app.config['PRINTER_IDLE_TIMEOUT']
+    backend_manager.retries = state.app.config['PRINTER_RETRIES']
+
+
+@bp.record_once
+def configure_printers(state):
+    printer_pool.configure(state.app.config['PRINTERS'] or [{
+        'name': 'default',
+        'model': state.app.config['PRINTER_MODEL'],
+        'device': state.app.config['PRINTER_PRINTER'],
+    }])
+
+
+@bp.record_once
+def load_partsbox_config(state):
+    partsbox_config.path = state.app.config['PARTSBOX_CONFIG_FILE']
+    partsbox_config.check_interval = state.app.config['PARTSBOX_CONFIG_CHECK_INTERVAL']
+    state.app.config['PARTSBOX'] = partsbox_config.load()
+
+
+@bp.before_app_request
+def reload_partsbox_config():
+    settings = partsbox_config.reload_if_changed()
+    if settings is not current_app.config['PARTSBOX']:
+        current_app.config['PARTSBOX'] = settings
+        # previews of PartsBox labels may show the old settings
+        preview_cache.clear()
+
+
 @bp.route('/')
 def index():
     return render_template('labeldesigner.html',
@@ -37,7 +120,8 @@ def index():
                            default_font_family=current_app.config['LABEL_DEFAULT_FONT_FAMILY'],
                            line_spacings=LINE_SPACINGS,
                            default_line_spacing=current_app.config['LABEL_DEFAULT_LINE_SPACING'],
-                           default_dpi=DEFAULT_DPI
+                           default_dpi=DEFAULT_DPI,
+                           draft_scale=DRAFT_SCALE
                            )
 
 
@@ -45,25 +129,182 @@ def index():
 def get_font_styles():
     font = request.values.get(
         'font', current_app.config['LABEL_DEFAULT_FONT_FAMILY'])
-    return FONTS.fonts[font]
+    response = make_response(FONTS.fonts[font])
+    # the styles only change when the fonts are scanned again
+    response.headers.set('Cache-Control', 'public, max-age={}'.format(
+        FONT_STYLES_MAX_AGE))
+    response.set_etag(FONTS.version)
+    return response.make_conditional(request)
+
+
+@bp.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return {
+        'fonts': font_cache.info(),
+        'qr': qr_cache.info(),
+        'label_templates': static_layer_cache.info(),
+        'preview': preview_cache.info(),
+        'assets': asset_store.info(),
+        'partsbox': [client.info() for client in get_clients()],
+        'printers': backend_manager.info(),
+        'live_preview': live_previews.info(),
+    }
+
+
+@bp.route('/api/printers', methods=['GET'])
+def get_printers():
+    """
+    API with the printers of the pool, the labels loaded into them, their
+    queues and the share of the time they spent printing
+
+    returns: JSON
+    """
+    return printer_pool.info()
+
+
+@bp.route('/api/partsbox/invalidate', methods=['POST'])
+def invalidate_partsbox_cache():
+    """
+    API to drop cached PartsBox data, e.g. after stock was moved
+
+    Pass part_id and/or storage_id to drop single entries, without them
+    everything is dropped. Cached previews are dropped in any case.
+
+    returns: JSON
+    """
+    for client in get_clients():
+        client.invalidate(
+            part_id=request.values.get('part_id', None),
+            storage_id=request.values.get('storage_id', None))
+    preview_cache.clear()
+    return {'success': True}
+
+
+@bp.route('/api/asset', methods=['POST'])
+def upload_asset():
+    """
+    API to upload an image or PDF once
+
+    The file (form field 'image') is decoded and converted to black & white
+    right away. Pass the returned asset_id to /api/preview and /api/print
+    instead of uploading the file again. For PDFs select the page with
+    page=<number>, or print one label per page with page=all.
+
+    returns: JSON
+    """
+    return_dict = {'success': False}
+
+    image = request.files.get('image', None)
+    if image is None:
+        return_dict['message'] = 'No file uploaded'
+        return return_dict
+
+    try:
+        return_dict['asset_id'] = asset_store.add(image)
+        return_dict['pages'] = asset_store.page_count(return_dict['asset_id'])
+    except Exception as e:
+        return_dict['message'] = str(e)
+        current_app.logger.error('Exception happened: %s', e)
+        return return_dict
+
+    return_dict['success'] = True
+    return return_dict
 
 
 @bp.route('/api/preview', methods=['POST', 'GET'])
 def get_preview_from_image():
-    label = create_label_from_request(request)
-    im = label.generate()
+    """
+    API to render a preview of a label
+
+    The preview shows the colors the printer prints: a 1-bit image, or a
+    palette image with red for two-color labels. draft=1 returns it at a
+    lower resolution. Previews are cached by their parameters and carry a
+    strong ETag, a matching If-None-Match header is answered with 304 Not
+    Modified. GET requests may be cached by the browser for PREVIEW_MAX_AGE
+    seconds.
+
+    returns: PNG image, lossless WebP image (return_format=webp) or the PNG
+             as base64 text (return_format=base64), 404 if asset_id is
+             unknown and the image needs to be uploaded again
+    """
+    try:
+        key, preview = get_preview(request.values, request.files.get('image', None))
+    except UnknownAssetError as e:
+        return {'success': False, 'message': str(e)}, 404
+    return make_preview_response(preview)
 
-    return_format = request.values.get('return_format', 'png')
 
-    if return_format == 'base64':
-        import base64
-        response = make_response(base64.b64encode(image_to_png_bytes(im)))
-        response.headers.set('Content-type', 'text/plain')
-        return response
-    else:
-        response = make_response(image_to_png_bytes(im))
-        response.headers.set('Content-type', 'image/png')
-        return response
+@bp.route('/api/preview/<key>', methods=['GET'])
+def get_cached_preview(key):
+    """
+    API returning a preview rendered before, see /api/preview/live
+
+    returns: the preview, 404 if it was dropped from the cache meanwhile
+    """
+    preview = preview_cache.get(key)
+    if preview is None:
+        return {'success': False, 'message': 'Unknown preview'}, 404
+    return make_preview_response(preview)
+
+
+@bp.route('/api/preview/live/<session_id>', methods=['POST'])
+def update_live_preview(session_id):
+    """
+    API to post the current label of a live preview session
+
+    Takes the parameters of /api/preview and returns right away, the preview
+    is pushed by /api/preview/live/<session_id>/events. Only the latest
+    state of a session gets rendered.
+
+    returns: JSON
+    """
+    try:
+        session = live_previews.get(session_id)
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}, 400
+
+    version = session.update(request.values.to_dict())
+    return {'success': True, 'version': version}
+
+
+@bp.route('/api/preview/live/<session_id>/events', methods=['GET'])
+def live_preview_events(session_id):
+    """
+    Server-sent events with the previews of a live preview session
+
+    Each event has the version of the rendered state and the url of the
+    preview, or an error message. States posted while a preview is being
+    rendered replace each other, only the latest one is rendered next.
+    """
+    try:
+        session = live_previews.get(session_id)
+    except ValueError as e:
+        return {'success': False, 'message': str(e)}, 400
+
+    def stream():
+        version = 0
+        try:
+            while True:
+                new_version, values = session.wait_for_update(version, timeout=15)
+                if new_version == version:
+                    yield ': keepalive\n\n'
+                    continue
+                live_previews.count_render(new_version, version)
+                version = new_version
+
+                event = {'version': version, 'draft': int(values.get('draft', 0)) == 1}
+                try:
+                    key, preview = get_preview(values)
+                    event['url'] = url_for('.get_cached_preview', key=key)
+                except Exception as e:
+                    current_app.logger.error('Exception happened: %s', e)
+                    event['error'] = str(e)
+                yield 'data: {}\n\n'.format(json.dumps(event))
+        finally:
+            live_previews.drop(session_id)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 @bp.route('/api/print', methods=['POST', 'GET'])
@@ -71,6 +312,9 @@ def print_text():
     """
     API to print a label
 
+    The label is handed to the spooler of the printer and the request returns
+    right away. Use the job_id to follow the job via /api/print/job/<job_id>.
+
     returns: JSON
 
     Ideas for additional URL parameters:
@@ -81,7 +325,7 @@ def print_text():
 
     try:
         printer = create_printer_from_request(request)
-        label = create_label_from_request(request)
+        labels = create_labels_from_request(request)
         print_count = int(request.values.get('print_count', 1))
         cut_once = int(request.values.get('cut_once', 0)) == 1
     except Exception as e:
@@ -89,35 +333,305 @@ def print_text():
         current_app.logger.error('Exception happened: %s', e)
         return return_dict
 
-    printer.add_label_to_queue(label, print_count, cut_once)
+    for label in labels:
+        printer.add_label_to_queue(label, print_count, cut_once)
+    job = submit_job(printer)
+
+    return_dict['success'] = True
+    return_dict['job_id'] = job.id
+    return return_dict
+
+
+@bp.route('/api/print/batch', methods=['POST'])
+def print_batch():
+    """
+    API to print many different labels as one print job
+
+    Takes a JSON list of labels, each an object with the parameters of
+    /api/print (print_count and cut_once included). Alternatively an object
+    with the list as labels and parameters shared by all of them. All labels
+    are rendered, with their PartsBox data fetched, before anything gets
+    printed. They need the same label_size and go to the printer in one
+    write.
+
+    returns: JSON, errors lists the index and message of each label that
+             can't be printed
+    """
+
+    return_dict = {'success': False}
+
+    batch = request.get_json(silent=True)
+    if isinstance(batch, list):
+        batch = {'labels': batch}
+    if not isinstance(batch, dict) or not isinstance(batch.get('labels'), list) \
+            or not batch['labels']:
+        return_dict['message'] = 'Expected a JSON list of labels'
+        return return_dict
+    shared = {key: value for key, value in batch.items() if key != 'labels'}
+
+    entries = []
+    errors = []
+    label_size = None
+    for index, spec in enumerate(batch['labels']):
+        try:
+            if not isinstance(spec, dict):
+                raise ValueError('Expected an object with the label parameters')
+            d = dict(shared, **spec)
+            if label_size is None:
+                label_size = d.get('label_size', '62')
+            elif d.get('label_size', '62') != label_size:
+                raise ValueError('All labels need the same label_size, '
+                                 'the first one is {}'.format(label_size))
+            print_count = int(d.get('print_count', 1))
+            cut_once = int(d.get('cut_once', 0)) == 1
+            for label in create_labels(d):
+                entries.append((index, label, print_count, cut_once))
+        except Exception as e:
+            errors.append({'index': index, 'message': str(e)})
+
+    try:
+        prefetch_partsbox_fields([label for index, label, print_count, cut_once in entries])
+    except Exception as e:
+        return_dict['message'] = str(e)
+        current_app.logger.error('Exception happened: %s', e)
+        return return_dict
+
+    # rendering fails for unknown parts or assets, find out before printing
+    rendered = []
+    failed = set(error['index'] for error in errors)
+    for index, label, print_count, cut_once in entries:
+        if index in failed:
+            continue
+        try:
+            rendered.append((RenderedLabel(label, label.generate()), print_count, cut_once))
+        except Exception as e:
+            errors.append({'index': index, 'message': str(e)})
+            failed.add(index)
+    errors.sort(key=lambda error: error['index'])
+
+    if errors:
+        return_dict['message'] = "{} of {} labels can't be printed".format(
+            len(errors), len(batch['labels']))
+        return_dict['errors'] = errors
+        return return_dict
 
     try:
-        printer.process_queue()
+        printer = create_printer(dict(shared, label_size=label_size))
     except Exception as e:
         return_dict['message'] = str(e)
         current_app.logger.error('Exception happened: %s', e)
         return return_dict
 
+    # the batch is printed whole or not at all
+    printer.streaming = False
+    for label, print_count, cut_once in rendered:
+        printer.add_label_to_queue(label, print_count, cut_once)
+    job = submit_job(printer)
+
     return_dict['success'] = True
+    return_dict['job_id'] = job.id
+    return_dict['count'] = len(rendered)
     return return_dict
 
 
+@bp.route('/api/print/csv', methods=['POST'])
+def print_csv():
+    """
+    API to print one label per row of an uploaded CSV file (mail merge)
+
+    Upload the file as csv, the other parameters are the same as for
+    /api/print. {column} in the text is replaced by the value of the column
+    in each row. The rows are read and printed one at a time, follow the
+    progress via /api/print/job/<job_id>.
+
+    returns: JSON
+    """
+
+    return_dict = {'success': False}
+
+    csv_path = None
+    try:
+        csv_file = request.files.get('csv', None)
+        if csv_file is None:
+            raise ValueError("No CSV file uploaded")
+        printer = create_printer_from_request(request)
+        template = create_label_from_request(request)
+        csv_path = save_csv(csv_file)
+        printer = MailMergeQueue(
+            model=printer.model,
+            device_specifier=printer.device_specifier,
+            label_size=printer.label_size,
+            template=template,
+            csv_path=csv_path,
+            count=int(request.values.get('print_count', 1)),
+            cut_once=int(request.values.get('cut_once', 0)) == 1)
+    except Exception as e:
+        if csv_path is not None:
+            os.remove(csv_path)
+        return_dict['message'] = str(e)
+        current_app.logger.error('Exception happened: %s', e)
+        return return_dict
+
+    job = submit_job(printer)
+
+    return_dict['success'] = True
+    return_dict['job_id'] = job.id
+    return_dict['count'] = printer.rows.count
+    return return_dict
+
+
+@bp.route('/api/print/job/<job_id>', methods=['GET'])
+def print_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return {'success': False, 'message': 'Unknown print job'}, 404
+
+    return_dict = job.to_dict()
+    return_dict['success'] = True
+    return return_dict
+
+
+@bp.route('/api/print/job/<job_id>/events', methods=['GET'])
+def print_job_events(job_id):
+    """
+    Server-sent events stream with the state of a print job, ends once the
+    job is done or failed.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return {'success': False, 'message': 'Unknown print job'}, 404
+
+    def stream():
+        version = -1
+        while True:
+            new_version = job.wait_for_change(version, timeout=15)
+            if new_version == version:
+                yield ': keepalive\n\n'
+                continue
+            version = new_version
+            yield 'data: {}\n\n'.format(json.dumps(job.to_dict()))
+            if job.finished:
+                break
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@bp.route('/api/partsbox/print', methods=['POST'])
+def print_partsbox_parts():
+    """
+    API to print the labels of many PartsBox parts as one print job
+
+    Pass the parts as part_ids (separated by commas or whitespace, or given
+    several times) or all parts of a storage location as storage_id. The
+    other parameters are the same as for /api/print. Part data is fetched in
+    the background while the first labels are already being rendered.
+
+    returns: JSON
+    """
+
+    return_dict = {'success': False}
+
+    try:
+        printer = create_printer_from_request(request)
+        client = get_partsbox_client()
+        part_ids = get_partsbox_part_ids(request, client)
+        labels = create_partsbox_labels_from_request(request, client, part_ids)
+        print_count = int(request.values.get('print_count', 1))
+        cut_once = int(request.values.get('cut_once', 0)) == 1
+    except Exception as e:
+        return_dict['message'] = str(e)
+        current_app.logger.error('Exception happened: %s', e)
+        return return_dict
+
+    for label in labels:
+        printer.add_label_to_queue(label, print_count, cut_once)
+    job = submit_job(printer)
+
+    return_dict['success'] = True
+    return_dict['job_id'] = job.id
+    return_dict['count'] = len(labels)
+    return return_dict
+
+
+def get_partsbox_client():
+    if current_app.config['PARTSBOX'] is None:
+        raise LookupError("PartsBox is not configured, see partsbox-config.yaml")
+    return get_client(current_app.config['PARTSBOX'])
+
+
+def get_partsbox_part_ids(request, client):
+    storage_id = request.values.get('storage_id', None)
+    if storage_id:
+        part_ids = client.get_storage_part_ids(storage_id)
+    else:
+        part_ids = [part_id
+                    for value in request.values.getlist('part_ids')
+                    for part_id in re.split(r'[\s,]+', value) if part_id]
+
+    if not part_ids:
+        raise ValueError("No PartsBox parts given")
+    invalid = [part_id for part_id in part_ids if len(part_id) != 26]
+    if invalid:
+        raise ValueError("Invalid PartsBox part ids: {}".format(', '.join(invalid)))
+    return part_ids
+
+
+def prefetch_partsbox_fields(labels):
+    """
+    Starts fetching the part data of the PartsBox part labels given by part
+    id among labels, all at once instead of one by one when they get rendered.
+    """
+    part_labels = [label for label in labels
+                   if label.label_content == LabelContent.PARTSBOX_PART
+                   and label.partsbox_fields is None
+                   and label.text and len(label.text) == 26]
+    if not part_labels or current_app.config['PARTSBOX'] is None:
+        return
+    client = get_partsbox_client()
+    part_ids = [label.text for label in part_labels]
+    for label, fields in zip(part_labels, client.prefetch_part_fields(part_ids)):
+        label.partsbox_fields = fields
+
+
+def create_partsbox_labels_from_request(request, client, part_ids):
+    """
+    Creates one PartsBox part label per part id, the part data is fetched in
+    the background and waited for when a label gets rendered.
+    """
+    label = create_label_from_request(request)
+    label.label_content = LabelContent.PARTSBOX_PART
+
+    labels = []
+    for part_id, fields in zip(part_ids, client.prefetch_part_fields(part_ids)):
+        part_label = copy.copy(label)
+        part_label.text = part_id
+        part_label.partsbox_fields = fields
+        labels.append(part_label)
+    return labels
+
+
 def create_printer_from_request(request):
-    d = request.values
+    return create_printer(request.values)
+
+
+def create_printer(d):
     context = {
-        'label_size': d.get('label_size', '62')
+        'label_size': d.get('label_size', '62'),
+        'printer': d.get('printer', None) or None,
     }
 
+    printer = printer_pool.select(context['label_size'], context['printer'])
     return PrinterQueue(
-        model = current_app.config['PRINTER_MODEL'],
-        device_specifier = current_app.config['PRINTER_PRINTER'],
-        label_size = context['label_size']
+        model = printer.model,
+        device_specifier = printer.device_specifier,
+        label_size = context['label_size'],
+        streaming = current_app.config['PRINTER_STREAMING']
     )
 
 
-def create_label_from_request(request):
-    d=request.values
-    context={
+def get_label_context(d):
+    return {
         'label_size': d.get('label_size', '62'),
         'print_type': d.get('print_type', 'text'),
         'label_orientation': d.get('orientation', 'standard'),
@@ -135,7 +649,147 @@ def create_label_from_request(request):
         'font_family': d.get('font_family'),
         'font_style': d.get('font_style'),
         'print_color': d.get('print_color', 'black'),
+        'asset_id': d.get('asset_id', None),
+        'page': d.get('page', '1'),
+    }
+
+
+def get_preview(d, image=None):
+    """
+    Returns the preview of a label from the cache, renders it if needed
+    :param d: mapping with the parameters of /api/preview
+    :param image: uploaded image or PDF, if not given as asset_id
+    :return: (key, (data, mimetype))
+    """
+    return_format = d.get('return_format', 'png')
+    if return_format == 'webp' and not features.check('webp'):
+        return_format = 'png'
+    draft = int(d.get('draft', 0)) == 1
+    key = get_preview_key(d, (return_format, draft), image)
+
+    preview = preview_cache.get(key)
+    if preview is None:
+        label = create_label(d, image)
+        im = image_to_print_colors(label.generate(), DRAFT_SCALE if draft else 1)
+
+        if return_format == 'base64':
+            preview = (base64.b64encode(image_to_compact_bytes(im)), 'text/plain')
+        elif return_format == 'webp':
+            preview = (image_to_compact_bytes(im, 'webp'), 'image/webp')
+        else:
+            preview = (image_to_compact_bytes(im), 'image/png')
+        preview_cache.put(key, preview)
+    return key, preview
+
+
+def make_preview_response(preview):
+    data, mimetype = preview
+    response = make_response(data)
+    response.headers.set('Content-type', mimetype)
+    response.headers.set('Cache-Control', 'private, max-age={}'.format(
+        current_app.config['PREVIEW_MAX_AGE']))
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    return response.make_conditional(request)
+
+
+def warm_up():
+    """
+    Renders a preview of each kind of label with the default settings of the
+    designer and throws it away. This loads the default font at the sizes
+    the labels use and runs the QR code, image and encoding code once, so
+    the first preview after a start is as fast as the others.
+    Needs an application context.
+    """
+    config = current_app.config
+    d = {
+        'label_size': config['LABEL_DEFAULT_SIZE'],
+        'orientation': config['LABEL_DEFAULT_ORIENTATION'],
+        'font_family': config['LABEL_DEFAULT_FONT_FAMILY'],
+        'font_style': config['LABEL_DEFAULT_FONT_STYLE'],
+        'font_size': config['LABEL_DEFAULT_FONT_SIZE'],
+        'line_spacing': config['LABEL_DEFAULT_LINE_SPACING'],
+        'qrcode_size': config['LABEL_DEFAULT_QR_SIZE'],
+        # a line for each field of the PartsBox labels
+        'text': '\n'.join(['Warm-up'] * 4),
     }
+    png = BytesIO()
+    Image.new('L', (32, 32), 'white').save(png, 'PNG')
+
+    for print_type in WARM_UP_PRINT_TYPES:
+        image = None
+        if print_type == 'image':
+            png.seek(0)
+            image = FileStorage(png, filename='warm-up.png')
+        try:
+            label = create_label(dict(d, print_type=print_type), image)
+            image_to_compact_bytes(image_to_print_colors(label.generate()))
+        except Exception as e:
+            current_app.logger.warning('Warm-up of %s labels failed: %s', print_type, e)
+
+
+def get_preview_key(d, output, image=None):
+    """
+    Digest of everything a preview depends on: the normalized label
+    parameters, the uploaded image (if any) and the output format and
+    resolution.
+    """
+    digest = hashlib.sha256(json.dumps(
+        [get_label_context(d), output], sort_keys=True,
+        default=str).encode())
+    if image is not None:
+        digest.update(image.read())
+        image.seek(0)
+    return digest.hexdigest()
+
+
+def get_pdf_page_size(context):
+    """
+    Size PDF pages are rasterized to fit into: the printable area of the
+    label, turned for rotated orientation. Endless labels have no height.
+    """
+    width, height = label_type_specs[context['label_size']]['dots_printable']
+    if height > width:
+        width, height = height, width
+    height = height or None
+    if context['label_orientation'] == 'rotated':
+        return (height, width)
+    return (width, height)
+
+
+def create_labels_from_request(request):
+    return create_labels(request.values, request.files.get('image', None))
+
+
+def create_labels(d, image=None):
+    """
+    Creates the labels to print, one per PDF page if page=all was requested
+    for an uploaded PDF and a single one otherwise.
+    """
+    context = get_label_context(d)
+    if context['print_type'] != 'image' or context['page'] != 'all' or \
+            not context['asset_id']:
+        return [create_label(d, image)]
+
+    # rasterizes all pages in parallel, the labels below get them from memory
+    pages = asset_store.get_pages(context['asset_id'], get_pdf_page_size(context))
+    if pages is None:
+        raise UnknownAssetError("Unknown asset, please upload the image again")
+    return [create_label(d, image, page=page)
+            for page in range(1, len(pages) + 1)]
+
+
+def create_label_from_request(request):
+    return create_label(request.values, request.files.get('image', None))
+
+
+def create_label(d, image=None, page=None):
+    """
+    Creates a label from the label parameters
+    :param d: mapping with the parameters of /api/print
+    :param image: uploaded image or PDF, if not given as asset_id
+    :param page: page of a PDF asset, overrides the page parameter
+    """
+    context = get_label_context(d)
 
     def get_label_dimensions(label_size):
         try:
@@ -155,14 +809,25 @@ def create_label_from_request(request):
         return font_path
 
     def get_uploaded_image(image):
+        if context['asset_id']:
+            asset_page = page or (1 if context['page'] == 'all' else int(context['page']))
+            page_count = asset_store.page_count(context['asset_id']) or 0
+            if page_count and not 1 <= asset_page <= page_count:
+                raise LookupError("The PDF has only {} pages".format(page_count))
+            image = asset_store.get(context['asset_id'], asset_page,
+                                    get_pdf_page_size(context))
+            if image is None:
+                raise UnknownAssetError("Unknown asset, please upload the image again")
+            return image
         try:
             name, ext = os.path.splitext(image.filename)
             if ext.lower() in ('.png', '.jpg', '.jpeg'):
                 image = imgfile_to_image(image)
-                return convert_image_to_bw(image, 200)
+                return convert_image_to_bw(image, BW_THRESHOLD)
             elif ext.lower() in ('.pdf'):
-                image = pdffile_to_image(image, DEFAULT_DPI)
-                return convert_image_to_bw(image, 200)
+                image = pdffile_to_image(image, DEFAULT_DPI,
+                                         size=get_pdf_page_size(context))
+                return convert_image_to_bw(image, BW_THRESHOLD)
             else:
                 return None
         except AttributeError:
@@ -218,8 +883,10 @@ def create_label_from_request(request):
         text_align=context['align'],
         qr_size=context['qrcode_size'],
         qr_correction=context['qrcode_correction'],
-        image=get_uploaded_image(request.files.get('image', None)),
+        image=get_uploaded_image(image),
         font_path=get_font_path(context['font_family'], context['font_style']),
         font_size=context['font_size'],
-        line_spacing=context['line_spacing']
+        line_spacing=context['line_spacing'],
+        label_company=(current_app.config['PARTSBOX'] or {}).get('PARTSBOX_COMPANY', ''),
+        partsbox_config=current_app.config['PARTSBOX']
     )
@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+# Number of finished jobs kept around so their status can still be queried
+JOB_HISTORY = 100
+
+
+class JobState(Enum):
+    QUEUED = 'queued'
+    RENDERING = 'rendering'
+    SENDING = 'sending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class PrintJob:
+
+    def __init__(self, printer):
+        self.id = uuid.uuid4().hex
+        self.printer = printer
+        self.message = None
+        self.created = time.time()
+        self.updated = self.created
+        self._state = JobState.QUEUED
+        self._progress = (0, 0)
+        self._version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def finished(self):
+        return self._state in (JobState.DONE, JobState.FAILED)
+
+    def set_state(self, state, message=None):
+        with self._changed:
+            self._state = state
+            if message is not None:
+                self.message = message
+            self._touch()
+
+    def set_progress(self, done, total):
+        with self._changed:
+            self._progress = (done, total)
+            self._touch()
+
+    def _touch(self):
+        self.updated = time.time()
+        self._version += 1
+        self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """ blocks until the job changed compared to the given version
+        :param version: last version seen by the caller, -1 for none
+        :param timeout: seconds to wait at most
+        :return: the current version (unchanged if the wait timed out)
+        """
+        with self._changed:
+            if self._version == version:
+                self._changed.wait(timeout)
+            return self._version
+
+    def to_dict(self):
+        with self._changed:
+            return {
+                'job_id': self.id,
+                'state': self._state.value,
+                'message': self.message,
+                'done': self._progress[0],
+                'total': self._progress[1],
+                'created': self.created,
+                'updated': self.updated,
+            }
+
+
+class PrintSpooler:
+    """ Feeds the jobs of one printer device through a dedicated thread """
+
+    def __init__(self, device_specifier):
+        self.device_specifier = device_specifier
+        self.busy = False
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.busy_seconds = 0.0
+        self.started = time.monotonic()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='spooler {}'.format(device_specifier),
+            daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        self._queue.put(job)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def load(self):
+        """ number of jobs queued or being printed """
+        return self._queue.qsize() + (1 if self.busy else 0)
+
+    def utilization(self):
+        """ share of the time since the spooler started spent on jobs """
+        elapsed = time.monotonic() - self.started
+        return self.busy_seconds / elapsed if elapsed > 0 else 0.0
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            self.busy = True
+            started = time.monotonic()
+            try:
+                job.printer.process_queue(
+                    on_state=job.set_state, on_progress=job.set_progress)
+            except Exception as e:
+                logger.error('Print job %s failed: %s', job.id, e)
+                self.jobs_failed += 1
+                job.set_state(JobState.FAILED, str(e))
+            else:
+                self.jobs_done += 1
+                job.set_state(JobState.DONE)
+            finally:
+                self.busy_seconds += time.monotonic() - started
+                self.busy = False
+                self._queue.task_done()
+
+
+_lock = threading.Lock()
+_spoolers = {}
+_jobs = OrderedDict()
+
+
+def get_spooler(device_specifier):
+    with _lock:
+        spooler = _spoolers.get(device_specifier)
+        if spooler is None:
+            spooler = PrintSpooler(device_specifier)
+            _spoolers[device_specifier] = spooler
+        return spooler
+
+
+def submit_job(printer):
+    """ queues the labels of a PrinterQueue on the spooler of its device
+    :param printer: PrinterQueue holding the labels to be printed
+    :return: the PrintJob tracking the progress
+    """
+    job = PrintJob(printer)
+    with _lock:
+        _jobs[job.id] = job
+        _prune_jobs()
+    get_spooler(printer.device_specifier).submit(job)
+    return job
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _prune_jobs():
+    finished = [job_id for job_id, job in _jobs.items() if job.finished]
+    for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+        del _jobs[job_id]
@@ -1,3 +1,13 @@
+var assetId = null;
+// Lossless WebP previews are the smallest, PNG where it isn't supported
+var previewFormat = document.createElement('canvas').toDataURL('image/webp').indexOf('data:image/webp') == 0 ? 'webp' : 'png';
+var previewRequest = null;
+var previewTimer = null;
+var previewUrl = null;
+// Live preview channel, the server renders only the latest posted label
+var liveSession = null;
+var liveSource = null;
+
 function formData(cut_once) {
     var text = $('#labelText').val();
     if (text == '') text = ' ';
@@ -20,25 +30,96 @@ function formData(cut_once) {
         print_color:       $('input[name=printColor]:checked').val(),
         line_spacing:      $('input[name=lineSpacing]:checked').val(),
         cut_once:          cut_once ? 1 : 0,
+        asset_id:          assetId,
+        page:              $('#pdfPage').val() || 1,
+    }
+}
+
+function updatePreview(blob, scale) {
+    if (previewUrl != null) {
+        URL.revokeObjectURL(previewUrl);
     }
+    previewUrl = URL.createObjectURL(blob);
+    showPreview(previewUrl, scale);
 }
 
-function updatePreview(data) {
-    $('#previewImg').attr('src', 'data:image/png;base64,' + data);
+function showPreview(src, scale) {
+    $('#previewImg').attr('src', src);
     var img = $('#previewImg')[0];
     img.onload = function() {
-        $('#labelWidth').html( (img.naturalWidth /{{default_dpi}}*2.54).toFixed(1));
-        $('#labelHeight').html((img.naturalHeight/{{default_dpi}}*2.54).toFixed(1));
+        $('#labelWidth').html( (img.naturalWidth /scale/{{default_dpi}}*2.54).toFixed(1));
+        $('#labelHeight').html((img.naturalHeight/scale/{{default_dpi}}*2.54).toFixed(1));
+    };
+}
+
+function previewData(draft) {
+    var data = formData();
+    delete data['print_count'];
+    delete data['cut_once'];
+    data['return_format'] = previewFormat;
+    data['draft'] = draft ? 1 : 0;
+    return data;
+}
+
+function startLivePreview() {
+    if (!window.EventSource || !window.crypto || !crypto.getRandomValues) {
+        return;
+    }
+    var bytes = crypto.getRandomValues(new Uint8Array(16));
+    liveSession = Array.from(bytes, function(b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+    liveSource = new EventSource('{{url_for('.live_preview_events', session_id='SESSION_ID')}}'.replace('SESSION_ID', liveSession));
+    liveSource.onmessage = function(event) {
+        var preview = JSON.parse(event.data);
+        if (preview['error']) {
+            reuploadAsset();
+        } else {
+            showPreview(preview['url'], preview['draft'] ? {{draft_scale}} : 1);
+        }
     };
 }
 
+function loadPreview(draft) {
+    if (liveSource != null && liveSource.readyState == EventSource.OPEN) {
+        $.post('{{url_for('.update_live_preview', session_id='SESSION_ID')}}'.replace('SESSION_ID', liveSession),
+               previewData(draft));
+        return;
+    }
+
+    // Only the latest preview matters, stop loading the previous one
+    if (previewRequest != null) {
+        previewRequest.abort();
+    }
+    var controller = new AbortController();
+    previewRequest = controller;
+
+    var data = previewData(draft);
+
+    fetch('{{url_for('.get_preview_from_image')}}?' + $.param(data), {signal: controller.signal})
+        .then(function(response) {
+            if (response.status == 404) {
+                // The server dropped the uploaded image
+                reuploadAsset();
+            }
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.blob();
+        })
+        .then(function(blob) {
+            updatePreview(blob, draft ? {{draft_scale}} : 1);
+        })
+        .catch(function(error) {
+            // replaced by a newer preview or failed, the last one stays
+        });
+}
+
 function updateStyles() {
     font_familiy = $('#fontFamily option:selected').text()
 
+    // GET, so the browser can cache the styles
     $.ajax({
-        type:        'POST',
+        type:        'GET',
         url:         '{{url_for('.get_font_styles')}}',
-        contentType: 'application/x-www-form-urlencoded; charset=UTF-8',
         data:        {font: font_familiy},
         success: function( data ) {
             var styleSelect = $('#fontStyle');
@@ -86,25 +167,21 @@ function preview() {
         $('#groupLabelImage').hide();
     }
 
-    if($('input[name=printType]:checked').val() == 'image') {
-        dropZoneMode = 'preview';
-        imageDropZone.processQueue();
+    if($('input[name=printType]:checked').val() == 'image' && assetId == null) {
         return;
     }
 
-    $.ajax({
-        type:        'POST',
-        url:         '{{url_for('.get_preview_from_image')}}?return_format=base64',
-        contentType: 'application/x-www-form-urlencoded; charset=UTF-8',
-        data:        formData(),
-        success: function( data ) {
-            updatePreview(data);
-        }
-    });
+    // A small draft right away while editing, full resolution once idle
+    loadPreview(true);
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(function() { loadPreview(false); }, 500);
 }
 
 function setStatus(data) {
-    if (data['success']) {
+    if (data['success'] && data['job_id']) {
+        $('#statusPanel').html('<div id="statusBox" class="alert alert-info" role="alert"><i class="fas fa-hourglass-half"></i><span>Print job queued...</span></div>');
+        watchJob(data['job_id']);
+    } else if (data['success']) {
         $('#statusPanel').html('<div id="statusBox" class="alert alert-success" role="alert"><i class="fas fa-check"></i><span>Printing was successful.</span></div>');
     } else {
         $('#statusPanel').html('<div id="statusBox" class="alert alert-warning" role="alert"><i class="fas fa-exclamation-triangle"></i><span>Printing was unsuccessful:<br />'+data['message']+'</span></div>');
@@ -113,17 +190,31 @@ function setStatus(data) {
     $('#dropdownPrintButton').prop('disabled', false);
 }
 
+function watchJob(job_id) {
+    var source = new EventSource('{{url_for('.print_job_events', job_id='JOB_ID')}}'.replace('JOB_ID', job_id));
+    source.onmessage = function(event) {
+        var job = JSON.parse(event.data);
+        if (job['state'] == 'done') {
+            source.close();
+            setStatus({'success': true});
+        } else if (job['state'] == 'failed') {
+            source.close();
+            setStatus({'success': false, 'message': job['message']});
+        } else {
+            var progress = job['total'] > 0 ? ' (' + job['done'] + '/' + job['total'] + ')' : '';
+            $('#statusPanel').html('<div id="statusBox" class="alert alert-info" role="alert"><i class="fas fa-hourglass-half"></i><span>Print job ' + job['state'] + progress + '...</span></div>');
+        }
+    };
+    source.onerror = function() {
+        source.close();
+    };
+}
+
 function print(cut_once = false) {
     $('#printButton').prop('disabled', true);
     $('#dropdownPrintButton').prop('disabled', true);
     $('#statusPanel').html('<div id="statusBox" class="alert alert-info" role="alert"><i class="fas fa-hourglass-half"></i><span>Processing print request...</span></div>');
 
-    if($('input[name=printType]:checked').val() == 'image') {
-        dropZoneMode = 'print';
-        imageDropZone.processQueue();
-        return;
-    }
-
     $.ajax({
         type:     'POST',
         dataType: 'json',
@@ -134,24 +225,43 @@ function print(cut_once = false) {
     });
 }
 
+startLivePreview();
 updateStyles();
 preview()
 
 
+function updatePages(pages) {
+    var pageSelect = $('#pdfPage');
+    pageSelect.empty();
+    for (var page = 1; page <= pages; page++) {
+        pageSelect.append($("<option></option>").attr("value", page).text(page));
+    }
+    if (pages > 1) {
+        pageSelect.append($("<option></option>").attr("value", "all").text("All pages, one label each"));
+        $('#groupPdfPage').show();
+    } else {
+        $('#groupPdfPage').hide();
+    }
+}
+
+function reuploadAsset() {
+    // The server may have dropped the uploaded image, send it once more
+    if($('input[name=printType]:checked').val() == 'image' && assetId != null && imageDropZone.files[0] != null) {
+        assetId = null;
+        imageDropZone.files[0].status = Dropzone.QUEUED;
+        imageDropZone.processQueue();
+    }
+}
+
+
 var imageDropZone;
 Dropzone.options.myAwesomeDropzone = {
-    url: function() {
-        if (dropZoneMode == 'preview') {
-            return "{{url_for('.get_preview_from_image')}}?return_format=base64";
-        } else {
-            return "{{url_for('.print_text')}}";
-        }
-    },
+    url: "{{url_for('.upload_asset')}}",
     paramName: "image",
     acceptedFiles: 'image/png,image/jpeg,application/pdf',
     maxFiles: 1,
     addRemoveLinks: true,
-    autoProcessQueue: false,
+    autoProcessQueue: true,
     init: function() {
         imageDropZone = this;
 
@@ -162,35 +272,23 @@ Dropzone.options.myAwesomeDropzone = {
         });
     },
 
-    sending: function(file, xhr, data) {
-        // append all parameters to the request
-        fd = formData(false);
-
-        $.each(fd, function(key, value){
-            data.append(key, value);
-        });
-    },
-
     success: function(file, response) {
-        // If preview or print was successfull update the previewpane or print status
-        if (dropZoneMode == 'preview') {
-            updatePreview(response);
+        // The image was uploaded once, previews and prints refer to its id
+        if (response['success']) {
+            assetId = response['asset_id'];
+            updatePages(response['pages']);
+            preview();
         } else {
             setStatus(response);
         }
-        file.status = Dropzone.QUEUED;
-    },
-
-    accept: function(file, done) {
-        // If a valid file was added, perform the preview
-        done();
-        preview();
     },
 
     removedfile: function(file) {
         file.previewElement.remove();
+        assetId = null;
+        updatePages(1);
         preview();
         // Insert a dummy image
-        updatePreview('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNgYAAAAAMAASsJTYQAAAAASUVORK5CYII=');
+        $('#previewImg').attr('src', 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNgYAAAAAMAASsJTYQAAAAASUVORK5CYII=');
     }
 };
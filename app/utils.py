@@ -2,7 +2,7 @@
 
 from PIL import Image
 from io import BytesIO
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
 
 
 def convert_image_to_bw(image, threshold):
@@ -13,23 +13,136 @@ def convert_image_to_bw(image, threshold):
 def imgfile_to_image(file):
     s = BytesIO()
     file.save(s)
-    im = Image.open(s)
+    s.seek(0)
+    return imgbytes_to_image(s.read())
+
+
+def imgbytes_to_image(data):
+    im = Image.open(BytesIO(data))
     return im
 
 
-def pdffile_to_image(file, dpi):
+def pdffile_to_image(file, dpi, page=1, size=None):
     s = BytesIO()
     file.save(s)
     s.seek(0)
-    im = convert_from_bytes(
-        s.read(),
-        dpi = dpi
-    )[0]
-    return im
+    return pdfbytes_to_image(s.read(), dpi, page, size)
+
+
+def pdfbytes_to_image(data, dpi, page=1, size=None):
+    return pdfbytes_to_images(data, dpi, page, page, size)[0]
+
+
+def pdfbytes_to_images(data, dpi, first_page=1, last_page=None, size=None,
+                       processes=1):
+    """ Rasterizes only the given page range of a PDF
+    :param size: (width, height) in pixels the pages are scaled to fit into,
+                 keeping their aspect ratio; one of them may be None to
+                 scale to the other one only; None to use dpi
+    :param processes: number of pdftoppm processes rasterizing in parallel
+    :return: list of greyscale images, one per page
+    """
+    if size is not None and None not in size:
+        # pdftoppm stretches to both sides, fit each page by the side
+        # limiting it, pages of the same shape in one run
+        if last_page is None:
+            last_page = pdfbytes_page_count(data)
+        runs = []
+        page_sizes = pdfbytes_page_sizes(data, first_page, last_page)
+        for page, page_size in enumerate(page_sizes, first_page):
+            fit = fit_size(page_size, size)
+            if runs and runs[-1][2] == fit:
+                runs[-1][1] = page
+            else:
+                runs.append([page, page, fit])
+        return [image for first, last, fit in runs
+                for image in _convert_pdf(data, dpi, first, last, fit, processes)]
+    return _convert_pdf(data, dpi, first_page, last_page, size, processes)
+
+
+def _convert_pdf(data, dpi, first_page, last_page, size, processes):
+    return convert_from_bytes(
+        data,
+        dpi = dpi,
+        first_page = first_page,
+        last_page = last_page,
+        size = size,
+        grayscale = True,
+        thread_count = processes
+    )
+
+
+def fit_size(page_size, size):
+    """ the size argument of pdftoppm fitting a page into size
+    :param page_size: (width, height) of the page, None if unknown
+    :param size: (width, height) bounds
+    :return: (width, None) or (None, height), whichever side limits the page
+    """
+    width, height = size
+    if page_size is None:
+        return (width, None)
+    page_width, page_height = page_size
+    if page_width * height >= page_height * width:
+        return (width, None)
+    return (None, height)
+
+
+def pdfbytes_page_sizes(data, first_page, last_page):
+    """ (width, height) in points of each page as shown, None if pdfinfo
+    doesn't tell """
+    info = pdfinfo_from_bytes(data, first_page=first_page, last_page=last_page)
+    sizes = []
+    for page in range(first_page, last_page + 1):
+        # pdfinfo only lists each page's size for a page range
+        size = info.get('Page {:4d} size'.format(page)) or info.get('Page size')
+        rotation = info.get('Page {:4d} rot'.format(page), 0)
+        try:
+            width, x, height = str(size).split()[:3]
+            width, height = float(width), float(height)
+            if int(rotation) % 180:
+                width, height = height, width
+            sizes.append((width, height))
+        except ValueError:
+            sizes.append(None)
+    return sizes
+
+
+def pdfbytes_page_count(data):
+    return pdfinfo_from_bytes(data)['Pages']
+
+
+# Grey levels up to this one get printed, brother_ql's default threshold of 70%
+PRINT_THRESHOLD = 255 - int((100.0 - 70) / 100.0 * 255)
+
+# White, black and red, the colors of two-color labels
+PRINT_PALETTE = [255, 255, 255, 0, 0, 0, 255, 0, 0]
+
+
+def image_to_print_colors(im, scale=1):
+    """ reduces a label image to the colors the printer prints
+    :param scale: factor to shrink the image by first, e.g. 0.5
+    :return: 1-bit image for black labels, palette image with white, black
+             and red otherwise
+    """
+    if scale != 1:
+        im = im.resize((max(1, round(im.size[0] * scale)),
+                        max(1, round(im.size[1] * scale))), Image.BOX)
+    if im.mode in ('1', 'L') or im.convert('HSV').getextrema()[1][1] == 0:
+        return convert_image_to_bw(im, PRINT_THRESHOLD)
+    palette = Image.new('P', (1, 1))
+    palette.putpalette(PRINT_PALETTE)
+    return im.convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
 
 
-def image_to_png_bytes(im):
+def image_to_compact_bytes(im, image_format='png'):
+    """ encodes a result of image_to_print_colors() as PNG or lossless WebP """
     image_buffer = BytesIO()
-    im.save(image_buffer, format="PNG")
-    image_buffer.seek(0)
-    return image_buffer.read()
\ No newline at end of file
+    if image_format == 'webp':
+        # WebP knows neither 1-bit nor palette images
+        im.convert('L' if im.mode == '1' else 'RGB').save(
+            image_buffer, format='WEBP', lossless=True)
+    elif im.mode == 'P':
+        im.save(image_buffer, format='PNG', bits=2)
+    else:
+        im.save(image_buffer, format='PNG')
+    return image_buffer.getvalue()
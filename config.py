@@ -17,6 +17,33 @@ class Config(object):
 
     PRINTER_MODEL = 'QL-570'
     PRINTER_PRINTER = 'file:///dev/usb/lp3'
+    # The connection to the printer is kept open between print jobs and
+    # closed after PRINTER_IDLE_TIMEOUT seconds without printing. Opening
+    # the connection is tried PRINTER_RETRIES more times, a failed write
+    # fails the print job as part of it may be printed already.
+    PRINTER_IDLE_TIMEOUT = 30
+    PRINTER_RETRIES = 3
+    # Labels are sent to the printer one by one as soon as they are rendered.
+    # With PRINTER_STREAMING = False a print job is sent in one piece once
+    # all of its labels are rendered.
+    PRINTER_STREAMING = True
+    # Several printers, each a dict with name, model, device and the
+    # label_size loaded into it (None for any), e.g.
+    #   {'name': 'left', 'model': 'QL-820NWB', 'device': 'tcp://192.168.1.21',
+    #    'label_size': '62red'}
+    # Print jobs go to the least busy printer with the requested labels.
+    # Left empty, PRINTER_MODEL and PRINTER_PRINTER print all labels.
+    PRINTERS = []
+
+    # Print jobs with at least RENDER_POOL_THRESHOLD different labels are
+    # rendered by RENDER_POOL_WORKERS processes, 0 for one per CPU core.
+    # With a single worker everything is rendered in the server process.
+    RENDER_POOL_WORKERS = 0
+    RENDER_POOL_THRESHOLD = 4
+
+    # Render one label of each kind at startup, so the first preview after
+    # a restart doesn't wait for fonts and code to be loaded
+    WARM_UP = True
 
     LABEL_DEFAULT_ORIENTATION = 'standard'
     LABEL_DEFAULT_SIZE = '62'
@@ -26,4 +53,26 @@ class Config(object):
     LABEL_DEFAULT_FONT_FAMILY = 'Liberation Sans'
     LABEL_DEFAULT_FONT_STYLE = 'Regular'
 
-    FONT_FOLDER = ''
\ No newline at end of file
+    FONT_FOLDER = ''
+    # The fonts found are saved to this file in the instance folder and
+    # loaded from it as long as the font directories don't change, '' to
+    # scan the fonts on every start
+    FONT_INDEX_FILE = 'font-index.json'
+    # Number of loaded font objects (file, size) kept in memory
+    FONT_CACHE_SIZE = 256
+    # Memory used for rendered previews and how long they stay valid in
+    # seconds (PartsBox labels show remote data which may change meanwhile)
+    PREVIEW_CACHE_BYTES = 32 * 1024 * 1024
+    PREVIEW_CACHE_TTL = 300
+    # Seconds browsers may reuse a preview fetched with GET without asking
+    PREVIEW_MAX_AGE = 60
+
+    # Where uploaded images are kept (default: 'assets' in the instance folder)
+    ASSET_FOLDER = ''
+    # Disk space and memory used for uploaded images
+    ASSET_STORE_BYTES = 64 * 1024 * 1024
+    ASSET_CACHE_BYTES = 32 * 1024 * 1024
+
+    # PartsBox settings, the file is reloaded when it changes
+    PARTSBOX_CONFIG_FILE = 'partsbox-config.yaml'
+    PARTSBOX_CONFIG_CHECK_INTERVAL = 5
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Prints the labels of many PartsBox parts through a running brother_ql_web
+#
+#   ./partsbox-print.py 1xfmbcn948genbg9jt6wm6phgv 2abcdefghijklmnopqrstuvwxy
+#   ./partsbox-print.py --storage <storage id>
+#   ./partsbox-print.py < part_ids.txt
+
+import argparse
+import sys
+import time
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print PartsBox part labels as one print job.')
+    parser.add_argument('part_ids', nargs='*', help='PartsBox part ids, read from stdin if none are given')
+    parser.add_argument('--storage', help='print the labels of all parts in this storage location instead')
+    parser.add_argument('--server', default='http://localhost:8013', help='URL of brother_ql_web')
+    parser.add_argument('--label-size', default='62')
+    parser.add_argument('--font-family')
+    parser.add_argument('--font-style')
+    parser.add_argument('--count', type=int, default=1, help='copies per part')
+    args = parser.parse_args()
+
+    data = {
+        'label_size': args.label_size,
+        'print_count': args.count,
+    }
+    if args.font_family:
+        data['font_family'] = args.font_family
+        data['font_style'] = args.font_style
+    if args.storage:
+        data['storage_id'] = args.storage
+    else:
+        data['part_ids'] = ' '.join(args.part_ids) if args.part_ids else sys.stdin.read()
+
+    response = requests.post(args.server + '/labeldesigner/api/partsbox/print', data=data)
+    result = response.json()
+    if not result['success']:
+        print('Printing failed: {}'.format(result['message']), file=sys.stderr)
+        sys.exit(1)
+    print('Printing {} labels, job {}'.format(result['count'], result['job_id']))
+
+    while True:
+        job = requests.get(args.server + '/labeldesigner/api/print/job/' + result['job_id']).json()
+        print('\r{} {}/{}'.format(job['state'], job['done'], job['total']), end='', flush=True)
+        if job['state'] in ('done', 'failed'):
+            break
+        time.sleep(1)
+    print()
+
+    if job['state'] == 'failed':
+        print('Printing failed: {}'.format(job['message']), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()